@@ -1,170 +1,440 @@
-#! /usr/bin/env python3
-from pathlib import Path
-import sys
-import re
-import fileinput
-import os
-import subprocess
-import argparse
-import random
-from typing import Tuple
-
-
-def replace_function(sm64_source: str, path_to_c_file: str, function: str):
-    path_to_c_file = str(Path(sm64_source) / Path(path_to_c_file))
-
-    with fileinput.input(files=[path_to_c_file], inplace=True) as fp:
-        inside = False
-        for line in fp:
-            if inside and line == "}\n":
-                print(line, end="")
-                print("#endif")
-                inside = False
-                continue
-
-            match = re.match(fr"(.*{function}.*) {{", line)
-            if match is not None:
-                inside = True
-                print("#if defined(VERSION_EU) && !defined(NON_MATCHING)")
-                print(match.group(1) + ";")
-                print(f'GLOBAL_ASM("asm/non_matchings/{function}_eu.s")')
-                print("#else")
-
-            print(line, end="")
-
-
-def write_asm(sm64_source: str, function: str, rom_offset: str) -> str:
-    sm64_tools = os.environ.get("SM64_TOOLS")
-    if not sm64_tools:
-        raise EnvironmentError(
-            "Env variable SM64_TOOLS should point to "
-            "sm64tools checkout with mipsdisasm built"
-        )
-    asm = subprocess.run(
-        [
-            sm64_tools + "/mipsdisasm",
-            "-p",
-            f"{sm64_source}/baserom.eu.z64",
-            f"0x80200000:{rom_offset}+0x1000",
-        ],
-        stdout=subprocess.PIPE,
-    ).stdout.decode("utf-8")
-
-    asm_filename = f"{sm64_source}/asm/non_matchings/{function}_eu.s"
-    rand_seed = str(random.randint(0, 99)) + "_"
-    with open(asm_filename, "w") as asm_file:
-        should_break = False
-        asm_file.write(f"glabel {function}\n")
-        for lineno, line in enumerate(asm.split("\n")):
-            if lineno < 4:
-                continue
-            line = line.replace("func_", "0x")
-            line = line.replace("D_", "0x")
-            line = line.replace(".L", ".L" + rand_seed)
-            asm_file.write(line + "\n")
-            print(line)
-            if should_break:
-                break
-            if "jr    $ra" in line:
-                # should_break = True
-                should_break = input("done? ") != "n"
-
-    return asm_filename
-
-
-def get_next_nonmatching(sm64_source: str) -> Tuple[str, str, str]:
-    os.chdir(sm64_source)
-    first_diff_cmd = str(Path(sm64_source) / "first-diff.py")
-    result = subprocess.run([first_diff_cmd], stdout=subprocess.PIPE)
-    output = result.stdout.decode("utf-8")
-    for line in output.split("\n"):
-        match = re.match(
-            # FOR THE OLD BEHAVIOR:
-            # r"First instruction difference at ROM addr .*, in (.*) "
-            # FOR THE NEW BEHAVIOR:
-            r"First difference at ROM addr .*, in (.*) "
-            r"\(ram .*, rom (.*), build/eu/(.*).o\)",
-            line,
-        )
-        if match:
-            function = match.group(1)
-            rom_offset = match.group(2)
-            path_to_c_file = match.group(3) + ".c"
-            return (function, rom_offset, path_to_c_file)
-    raise Exception("first-diff.py output didn't match expectations")
-
-
-def make(sm64_source) -> bool:
-    os.chdir(sm64_source)
-    result = subprocess.run(["make", "VERSION=eu", "COMPARE=0"], stdout=subprocess.PIPE)
-    if result.returncode != 0:
-        print(result.stdout)
-    return result.returncode == 0
-
-
-def prompt(question_mark: bool = False) -> str:
-    response = ""
-    while response not in ["y", "n"] + (["?"] if question_mark else []):
-        response = input(f"continue? y/n{'/?' if question_mark else ''}: ")
-    return response
-
-
-def main(sm64_source: str, no_replace: bool):
-    print("first-diffing...")
-    function, rom_offset, path_to_c_file = get_next_nonmatching(sm64_source)
-
-    print(f"got function = {function}, offset = {rom_offset}, path = {path_to_c_file}")
-    if "/" in function or "." in function:
-        print("function looks wrong. bailing.")
-        return
-
-    response = prompt(question_mark=True)
-    if response == "?":
-        print("ok, you want to change the target c file to modify.")
-        print("(this is for .inc.c-type files - behavior_actions in particular)")
-        path_to_c_file = input("what's the actual c file path?")
-    elif response == "n":
-        print("bailing.")
-        return
-
-    print("overwriting asm file...")
-    asm_filename = write_asm(sm64_source, function, rom_offset)
-
-    response = prompt(question_mark=True)
-    if response == "?":
-        print(Path(asm_filename).read_text())
-        response = prompt(question_mark=False)
-    if response == "n":
-        print(f"bailing. go delete that asm file ({asm_filename})")
-        return
-
-    if not no_replace:
-        print("injecting c file contents...")
-        replace_function(sm64_source, path_to_c_file, function)
-
-    print("making...")
-    result = make(sm64_source)
-    if not result:
-        print("something went wrong during make. bailing.")
-        return
-
-    print("first-diffing again...")
-    function2, rom_offset2, _ = get_next_nonmatching(sm64_source)
-    if function == function2 or rom_offset == rom_offset2:
-        print(f"functions or rom offsets match ({function2}, {rom_offset2}).")
-        print("you'll likely have to #define static to find the real next function.")
-        return
-    else:
-        print("seems different enough.")
-
-    print("done")
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("sm64_source", help="Path to sm64_source")
-    parser.add_argument(
-        "--no-replace", help="Don't modify the C file", action="store_true"
-    )
-    args = parser.parse_args()
-    main(args.sm64_source, args.no_replace)
+#! /usr/bin/env python3
+from pathlib import Path
+import os
+import subprocess
+import argparse
+import random
+import time
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import c_functions
+import linker_map
+import mips
+import rom_diff
+import symbol_db
+from edit_plan import EditPlan
+from rom import Rom
+
+
+def replace_functions(
+    sm64_source: str,
+    path_to_c_file: str,
+    functions: List[str],
+    plan: Optional[EditPlan] = None,
+) -> List[str]:
+    """Stub out every function in functions with EU GLOBAL_ASM in one rewrite.
+
+    The edit is added to plan if one is given and applied right away if not.
+    """
+    c_path = Path(sm64_source) / Path(path_to_c_file)
+    edits = plan or EditPlan()
+    source, wrapped = c_functions.wrap_functions(edits.read_text(c_path), functions)
+    for function in functions:
+        if function not in wrapped:
+            print(f"{function} not found in {path_to_c_file}")
+    edits.write_text(c_path, source)
+    if plan is None:
+        edits.apply()
+    return wrapped
+
+
+def replace_function(sm64_source: str, path_to_c_file: str, function: str):
+    replace_functions(sm64_source, path_to_c_file, [function])
+
+
+def get_function_bounds(
+    sm64_source: str, function: str, rom_offset: int, rom: Optional[Rom] = None
+) -> Tuple[int, int]:
+    """(vram, size) of the function at rom_offset in rom (the baserom by default).
+
+    The size comes from following its branches to the final jr $ra. The map
+    only bounds it: it lists global symbols alone, so the distance to the
+    next one also covers any static functions that follow.
+    """
+    rom = rom or Rom.baserom(sm64_source)
+    for row in symbol_db.open_db(sm64_source).symbols_in_range(
+        rom_offset, rom_offset + 1, by="rom"
+    ):
+        if row.section == ".text" and row.size:
+            words = rom.words(rom_offset, rom_offset + row.size)
+            return row.ram, mips.function_size(words, row.ram)
+
+    input_section = linker_map.load_map(sm64_source).input_at_rom(rom_offset)
+    if input_section is None or input_section.rom is None:
+        raise Exception(f"{function} at {rom_offset:#x} isn't in the map file")
+    vram = input_section.ram + rom_offset - input_section.rom
+    words = rom.words(rom_offset, rom_offset + 0x1000)
+    return vram, mips.function_size(words, vram)
+
+
+def write_asm(
+    sm64_source: str,
+    function: str,
+    rom_offset: str,
+    size: Optional[int] = None,
+    label_prefix: Optional[str] = None,
+    plan: Optional[EditPlan] = None,
+) -> str:
+    """Disassemble exactly one function of the baserom into its GLOBAL_ASM file."""
+    start = int(rom_offset, 16)
+    vram, mapped_size = get_function_bounds(sm64_source, function, start)
+    size = size or mapped_size
+    words = Rom.baserom(sm64_source).words(start, start + size)
+
+    if label_prefix is None:
+        label_prefix = str(random.randint(0, 99)) + "_"
+    lines = [f"glabel {function}"]
+    for line in mips.disassemble(words, vram, start):
+        line = line.replace("func_", "0x")
+        line = line.replace("D_", "0x")
+        line = line.replace(".L", ".L" + label_prefix)
+        lines.append(line)
+
+    asm_filename = f"{sm64_source}/asm/non_matchings/{function}_eu.s"
+    edits = plan or EditPlan()
+    edits.write_text(asm_filename, "\n".join(lines) + "\n")
+    if plan is None:
+        edits.apply()
+    return asm_filename
+
+
+class Nonmatching(NamedTuple):
+    function: str
+    rom_offset: str
+    size: int
+    path_to_c_file: str
+
+
+def get_all_nonmatching(sm64_source: str) -> List[Nonmatching]:
+    """Every mapped function in a C object whose built bytes differ from baserom."""
+    function_starts = {
+        symbol.rom for symbol, _ in linker_map.load_map(sm64_source).text_symbols()
+    }
+    with timed_phase("diff"):
+        locations = rom_diff.diff_roms(sm64_source)
+    nonmatching: Dict[str, Nonmatching] = {}
+    for location in locations:
+        if location.c_file is None or location.symbol_rom not in function_starts:
+            continue
+        if location.symbol not in nonmatching:
+            _, size = get_function_bounds(
+                sm64_source, location.symbol, location.symbol_rom
+            )
+            nonmatching[location.symbol] = Nonmatching(
+                location.symbol, hex(location.symbol_rom), size, location.c_file
+            )
+    return list(nonmatching.values())
+
+
+def stub_out(
+    sm64_source: str, batch: List[Nonmatching], dry_run: bool = False
+) -> Tuple[List[Nonmatching], Dict[Path, Optional[bytes]]]:
+    """Guard every function in batch and write its asm.
+
+    Functions that aren't found in their C file (e.g. because they live in
+    an .inc.c it includes) are left alone. Returns the entries that were
+    stubbed out and what each touched file held before, None if it didn't
+    exist.
+    """
+    plan = EditPlan()
+    by_c_file: Dict[str, List[str]] = {}
+    for entry in batch:
+        by_c_file.setdefault(entry.path_to_c_file, []).append(entry.function)
+    wrapped = {
+        (path_to_c_file, function)
+        for path_to_c_file, functions in by_c_file.items()
+        for function in replace_functions(sm64_source, path_to_c_file, functions, plan)
+    }
+
+    stubbed = [
+        entry for entry in batch if (entry.path_to_c_file, entry.function) in wrapped
+    ]
+    for entry in stubbed:
+        write_asm(
+            sm64_source,
+            entry.function,
+            entry.rom_offset,
+            entry.size,
+            label_prefix=entry.function + "_",
+            plan=plan,
+        )
+    originals = {
+        path: data if path.exists() else None for path, data in plan.originals.items()
+    }
+    plan.apply(dry_run)
+    return stubbed, originals
+
+
+def undo_stub_out(originals: Dict[Path, Optional[bytes]]):
+    """Put back every file stub_out touched, removing the ones it created."""
+    plan = EditPlan()
+    for path, data in originals.items():
+        if data is None:
+            plan.delete(path)
+        else:
+            plan.write_bytes(path, data)
+    plan.apply()
+
+
+def build_batch(
+    sm64_source: str, batch: List[Nonmatching], jobs: int = 1
+) -> List[Nonmatching]:
+    """Stub out batch and make once, bisecting only if the build breaks.
+
+    Returns the entries that are stubbed out in a successful build.
+    """
+    stubbed, originals = stub_out(sm64_source, batch)
+    if not stubbed:
+        return []
+    print(f"making with {len(stubbed)} stubbed functions...")
+    if make(sm64_source, [entry.path_to_c_file for entry in stubbed], jobs):
+        return stubbed
+
+    undo_stub_out(originals)
+    if len(stubbed) == 1:
+        print(f"{stubbed[0].function} breaks the build. skipping it.")
+        return []
+    half = len(stubbed) // 2
+    return build_batch(sm64_source, stubbed[:half], jobs) + build_batch(
+        sm64_source, stubbed[half:], jobs
+    )
+
+
+def aligned_prefix(
+    sm64_source: str, entries: List[Nonmatching]
+) -> Tuple[List[Nonmatching], bool]:
+    """The entries up to and including the first whose built size is off.
+
+    Their offsets come from the build's map, which only matches the baserom
+    up to the first function whose size differs; after it everything is
+    shifted. Also returns whether the list was cut short.
+    """
+    # Not Rom.builtrom: that mapping is shared and goes stale across rebuilds.
+    built = Rom(Path(sm64_source) / "build" / "eu" / "sm64.eu.z64")
+    for i, entry in enumerate(entries):
+        _, built_size = get_function_bounds(
+            sm64_source, entry.function, int(entry.rom_offset, 16), built
+        )
+        if built_size != entry.size:
+            print(
+                f"{entry.function} is {built_size:#x} bytes in the build and "
+                f"{entry.size:#x} in the baserom; stopping the batch there."
+            )
+            return entries[: i + 1], i + 1 < len(entries)
+    return entries, False
+
+
+def main_batch(
+    sm64_source: str, limit: Optional[int], jobs: int = 1, dry_run: bool = False
+):
+    """Stub out differing functions, rebuilding and re-diffing in rounds.
+
+    A round stops at the first function whose size changed, since every
+    offset after it stays shifted until the build is redone.
+    """
+    attempted: Set[str] = set()
+    skipped: Set[str] = set()
+    stubbed: List[Nonmatching] = []
+    while limit is None or len(attempted) < limit:
+        symbol_db.open_db(sm64_source).refresh()
+        print("diffing...")
+        candidates = []
+        for entry in get_all_nonmatching(sm64_source):
+            if entry.function in attempted or entry.function in skipped:
+                continue
+            if "/" in entry.function or "." in entry.function:
+                print(f"{entry.function} looks wrong. skipping it.")
+                skipped.add(entry.function)
+                continue
+            candidates.append(entry)
+        if limit is not None:
+            candidates = candidates[: limit - len(attempted)]
+        batch, cut_short = aligned_prefix(sm64_source, candidates)
+        if not batch:
+            break
+
+        if dry_run:
+            stub_out(sm64_source, batch, dry_run=True)
+            return
+
+        print(f"stubbing out {len(batch)} functions...")
+        stubbed += build_batch(sm64_source, batch, jobs)
+        attempted.update(entry.function for entry in batch)
+        if not cut_short:
+            break
+
+    if not attempted:
+        print("nothing differs.")
+        return
+    print("diffing again...")
+    still_differing = {entry.function for entry in get_all_nonmatching(sm64_source)}
+    for entry in stubbed:
+        if entry.function in still_differing:
+            print(f"{entry.function} ({entry.path_to_c_file}) still differs.")
+    print(f"done: {len(stubbed)}/{len(attempted)} functions stubbed out")
+    print_phase_times()
+
+
+def get_next_nonmatching(sm64_source: str) -> Tuple[str, str, str]:
+    with timed_phase("diff"):
+        locations = rom_diff.diff_roms(sm64_source)
+    for location in locations:
+        if location.c_file is not None and location.symbol is not None:
+            return (location.symbol, hex(location.symbol_rom), location.c_file)
+    raise Exception("no differing function in a C file")
+
+
+PHASE_TIMES: Dict[str, float] = {}
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    """Add the wall-clock time of the block to PHASE_TIMES[phase]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_TIMES[phase] = PHASE_TIMES.get(phase, 0.0) + elapsed
+
+
+def print_phase_times():
+    for phase, elapsed in PHASE_TIMES.items():
+        print(f"{phase}: {elapsed:.2f}s")
+
+
+def make(sm64_source, c_files: Optional[Iterable[str]] = None, jobs: int = 1) -> bool:
+    """Rebuild the objects of c_files, then everything else that's stale.
+
+    .inc.c files have no object of their own; the final make picks up
+    whatever includes them.
+    """
+    os.chdir(sm64_source)
+    make_cmd = ["make", "VERSION=eu", "COMPARE=0", f"-j{jobs}"]
+    objects = sorted(
+        {
+            f"build/eu/{Path(c_file).with_suffix('.o')}"
+            for c_file in c_files or []
+            if not c_file.endswith(".inc.c")
+        }
+    )
+    phases = [("compile", make_cmd + objects)] if objects else []
+    phases.append(("link", make_cmd))
+    for phase, cmd in phases:
+        with timed_phase(phase):
+            result = subprocess.run(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+            )
+        if result.returncode != 0:
+            print(result.stdout.decode("utf-8", errors="replace"))
+            return False
+    return True
+
+
+def prompt(question_mark: bool = False) -> str:
+    response = ""
+    while response not in ["y", "n"] + (["?"] if question_mark else []):
+        response = input(f"continue? y/n{'/?' if question_mark else ''}: ")
+    return response
+
+
+def main(sm64_source: str, no_replace: bool, jobs: int = 1):
+    symbol_db.open_db(sm64_source).refresh()
+    print("first-diffing...")
+    function, rom_offset, path_to_c_file = get_next_nonmatching(sm64_source)
+
+    print(f"got function = {function}, offset = {rom_offset}, path = {path_to_c_file}")
+    if "/" in function or "." in function:
+        print("function looks wrong. bailing.")
+        return
+
+    response = prompt(question_mark=True)
+    if response == "?":
+        print("ok, you want to change the target c file to modify.")
+        print("(this is for .inc.c-type files - behavior_actions in particular)")
+        path_to_c_file = input("what's the actual c file path?")
+    elif response == "n":
+        print("bailing.")
+        return
+
+    print("overwriting asm file...")
+    asm_filename = write_asm(sm64_source, function, rom_offset)
+
+    response = prompt(question_mark=True)
+    if response == "?":
+        print(Path(asm_filename).read_text())
+        response = prompt(question_mark=False)
+    if response == "n":
+        print(f"bailing. go delete that asm file ({asm_filename})")
+        return
+
+    if not no_replace:
+        print("injecting c file contents...")
+        replace_function(sm64_source, path_to_c_file, function)
+
+    print("making...")
+    result = make(sm64_source, [path_to_c_file], jobs)
+    print_phase_times()
+    if not result:
+        print("something went wrong during make. bailing.")
+        return
+
+    print("first-diffing again...")
+    function2, rom_offset2, _ = get_next_nonmatching(sm64_source)
+    if function == function2 or rom_offset == rom_offset2:
+        print(f"functions or rom offsets match ({function2}, {rom_offset2}).")
+        print("you'll likely have to #define static to find the real next function.")
+        print(f"differences left inside {function2}:")
+        with timed_phase("diff"):
+            locations = rom_diff.diff_roms(sm64_source)
+        for location in locations:
+            if location.symbol == function2:
+                print(f"  rom {location.start:#x}-{location.end:#x}")
+        return
+    else:
+        print("seems different enough.")
+
+    print("done")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sm64_source", help="Path to sm64_source")
+    parser.add_argument(
+        "--no-replace", help="Don't modify the C file", action="store_true"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Stub out every differing function without prompting, one make",
+    )
+    parser.add_argument(
+        "--limit", type=int, help="With --batch, stub out at most this many"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of make jobs",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --batch, print the edits instead of making them",
+    )
+    args = parser.parse_args()
+    if args.batch:
+        main_batch(args.sm64_source, args.limit, args.jobs, args.dry_run)
+    else:
+        main(args.sm64_source, args.no_replace, args.jobs)
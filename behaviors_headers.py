@@ -1,136 +1,274 @@
-#! /usr/bin/env python3
-
-import argparse
-import subprocess
-from pathlib import Path
-from typing import List, Optional, Set
-
-
-def get_unknown_symbols(bhv_path: str) -> Set[str]:
-    out_list = subprocess.run(
-        [
-            "gcc",
-            "-g",
-            *("-nostdinc", "-std=gnu90"),
-            *("-Wall", "-Wextra", "-Wno-format-security"),
-            *("-DTARGET_N64", "-DNON_MATCHING", "-DAVOID_UB"),
-            bhv_path,
-        ],
-        stderr=subprocess.PIPE,
-    ).stderr.split(b"\n")
-    lines = [line.decode("utf-8") for line in out_list if b"undeclared" in line]
-    suffixes = [line[line.index("‘") + 1 :] for line in lines if "‘" in line]
-    return set([prefix[: prefix.index("’")] for prefix in suffixes])
-
-
-def get_unknown_functions(bhv_path) -> Set[str]:
-    out_list = subprocess.run(
-        [
-            "gcc",
-            "-g",
-            *("-nostdinc", "-std=gnu90"),
-            *("-Wall", "-Wextra", "-Wno-format-security"),
-            *("-DTARGET_N64", "-DNON_MATCHING", "-DAVOID_UB"),
-            bhv_path,
-        ],
-        stderr=subprocess.PIPE,
-    ).stderr.split(b"\n")
-    lines = [
-        line.decode("utf-8")
-        for line in out_list
-        if b"implicit declaration of function" in line
-    ]
-    suffixes = [line[line.index("‘") + 1 :] for line in lines if "‘" in line]
-    return set([prefix[: prefix.index("’")] for prefix in suffixes])
-
-
-def find_symbol(symbol: str) -> Optional[str]:
-    if symbol.startswith("DIALOG"):
-        return "include/dialog_ids.h"
-    elif symbol.startswith("COURSE_"):
-        return "include/course_table.h"
-    elif symbol.startswith("SEQ_"):
-        return "include/seq_ids.h"
-    elif "_seg7_collision" in symbol:
-        return "levels/" + symbol[: symbol.index("_seg7_collision")] + "/header.h"
-
-    comments = r"\/\*(\*(?!\/)|[^*])*\*\/"
-    defines = fr"^(\s|{comments})*#define\s({comments})*\s*{symbol}\s"
-    typedefs = fr"typedef.*\s{symbol};"
-    declarations = fr"[^=]+\s[\*]*{symbol}(\[.*\])*;"
-    for pattern in [defines, typedefs, declarations]:
-        results = subprocess.run(
-            ["grep", "-r", "-P", pattern, "src", "include",], stdout=subprocess.PIPE,
-        ).stdout.split(b"\n")
-        nontrivial_files = [result for result in results if result != b""]
-        true_h_files = [
-            filename[: filename.index(b":")]
-            for filename in nontrivial_files
-            if b".h" in filename
-        ]
-        if true_h_files:
-            break
-
-    if len(true_h_files) == 0:
-        print(f"{symbol} not found")
-        return None
-
-    almost_there = true_h_files[0].decode("utf-8")
-    if almost_there == "include/PR/mbi.h":
-        return "include/PR/ultratypes.h"
-    else:
-        return almost_there
-
-
-def find_function(func: str) -> Optional[str]:
-    if func in ["sins", "coss"]:
-        return "src/engine/math_util.h"
-    pattern = fr"^[\w\s\*]*\w[\w\s\*]*[\s\*]+{func}\([^\(\)]*\);"
-    # print(pattern)
-    results = subprocess.run(
-        ["grep", "-r", "-P", pattern, "src", "include",], stdout=subprocess.PIPE,
-    ).stdout.split(b"\n")
-    nontrivial_files = [result for result in results if result != b""]
-    true_h_files = [
-        filename[: filename.index(b":")]
-        for filename in nontrivial_files
-        if b".h" in filename
-    ]
-
-    if len(true_h_files) == 0:
-        print(f"{func} not found")
-        return None
-
-    file = true_h_files[0].decode("utf-8")
-    # print(file)
-    return file
-
-
-def get_print_includes(files) -> List[str]:
-    lst_files = []
-    for file in files:
-        lst_files.append(f'#include "{file}"')
-    return lst_files
-
-
-if __name__ == "__main__":
-    for bhv_file in (Path("./src") / "game" / "behaviors").iterdir():
-        files: Set[str] = set(["include/object_fields.h"])
-        symbols = get_unknown_symbols(bhv_file)
-        for symbol in symbols:
-            if file := find_symbol(symbol):
-                files.add(file)  # type: ignore
-
-        functions = get_unknown_functions(bhv_file)
-        for func in functions:
-            # print(func)
-            if file := find_function(func):
-                files.add(file)  # type: ignore
-
-        includes = get_print_includes(files)
-        print(bhv_file)
-        print("\n".join(sorted(includes)))
-
-        lines = bhv_file.read_text().split("\n")
-        lines = list(sorted(includes)) + lines
-        bhv_file.write_text("\n".join(lines))
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import parallel
+import symbol_db
+from edit_plan import EditPlan
+
+GCC_FLAGS = [
+    *("-nostdinc", "-std=gnu90"),
+    *("-Wall", "-Wextra", "-Wno-format-security"),
+    *("-DTARGET_N64", "-DNON_MATCHING", "-DAVOID_UB"),
+    # The includes we add are relative to the repo root.
+    "-I.",
+]
+
+DEFAULT_INCLUDES = {"include/object_fields.h"}
+
+QUOTED_NAME_RE = re.compile(r"[‘'](\w+)[’']")
+
+
+class Diagnostics(NamedTuple):
+    symbols: Set[str]
+    functions: Set[str]
+    # (kind, message) of every diagnostic. Locations are left out since they
+    # move whenever an include is added or removed.
+    messages: FrozenSet[Tuple[str, str]]
+
+
+def diagnose(bhv_path: Union[str, Path]) -> Diagnostics:
+    """Everything gcc reports about bhv_path, in one pass."""
+    out = subprocess.run(
+        [
+            "gcc",
+            "-fsyntax-only",
+            "-fdiagnostics-format=json",
+            *GCC_FLAGS,
+            str(bhv_path),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    # gcc (9+) prints the diagnostics as one JSON array on stderr.
+    diagnostics = json.loads(out.stderr or b"[]")
+
+    symbols: Set[str] = set()
+    functions: Set[str] = set()
+    for diagnostic in diagnostics:
+        message = diagnostic["message"]
+        match = QUOTED_NAME_RE.search(message)
+        if not match:
+            continue
+        if "implicit declaration of function" in message:
+            functions.add(match.group(1))
+        elif "undeclared" in message:
+            symbols.add(match.group(1))
+    messages = frozenset(
+        (diagnostic["kind"], diagnostic["message"]) for diagnostic in diagnostics
+    )
+    return Diagnostics(symbols, functions, messages)
+
+
+def get_unknown_names(bhv_path: Union[str, Path]) -> Tuple[Set[str], Set[str]]:
+    """Undeclared identifiers and implicitly declared functions in one gcc pass."""
+    diagnostics = diagnose(bhv_path)
+    return diagnostics.symbols, diagnostics.functions
+
+
+@lru_cache(maxsize=None)
+def get_db() -> symbol_db.SymbolDatabase:
+    """The symbol database for the cwd, with its header index brought up to date."""
+    db = symbol_db.open_db(".")
+    db.refresh(linked=False, headers=True)
+    return db
+
+
+def find_symbol(symbol: str) -> Optional[str]:
+    if symbol.startswith("DIALOG"):
+        return "include/dialog_ids.h"
+    elif symbol.startswith("COURSE_"):
+        return "include/course_table.h"
+    elif symbol.startswith("SEQ_"):
+        return "include/seq_ids.h"
+    elif "_seg7_collision" in symbol:
+        return "levels/" + symbol[: symbol.index("_seg7_collision")] + "/header.h"
+
+    true_h_files = get_db().headers_declaring(
+        symbol, ["define", "typedef", "declaration"]
+    )
+    if len(true_h_files) == 0:
+        print(f"{symbol} not found")
+        return None
+
+    almost_there = true_h_files[0]
+    if almost_there == "include/PR/mbi.h":
+        return "include/PR/ultratypes.h"
+    else:
+        return almost_there
+
+
+def find_function(func: str) -> Optional[str]:
+    if func in ["sins", "coss"]:
+        return "src/engine/math_util.h"
+    true_h_files = get_db().headers_declaring(func, ["function"])
+    if len(true_h_files) == 0:
+        print(f"{func} not found")
+        return None
+
+    file = true_h_files[0]
+    # print(file)
+    return file
+
+
+def get_print_includes(files) -> List[str]:
+    lst_files = []
+    for file in files:
+        lst_files.append(f'#include "{file}"')
+    return lst_files
+
+
+def resolve_includes(symbols: Iterable[str], functions: Iterable[str]) -> Set[str]:
+    files: Set[str] = set()
+    for symbol in symbols:
+        if file := find_symbol(symbol):
+            files.add(file)
+    for func in functions:
+        if file := find_function(func):
+            files.add(file)
+    return files
+
+
+def with_includes(source: str, files: Iterable[str]) -> str:
+    return "\n".join(sorted(get_print_includes(files)) + source.split("\n"))
+
+
+def check_file(bhv_file: Path, source: str, files: Set[str]) -> Diagnostics:
+    """Diagnose bhv_file as it would be with the given includes.
+
+    The candidate is written next to bhv_file, which itself is left alone.
+    """
+    scratch = bhv_file.with_name(f".{bhv_file.name}.check.c")
+    scratch.write_text(with_includes(source, files))
+    try:
+        return diagnose(scratch)
+    finally:
+        scratch.unlink()
+
+
+def prune_includes(
+    bhv_file: Path, source: str, files: Set[str], diagnostics: Diagnostics
+) -> Set[str]:
+    """Drop every include whose removal adds no diagnostic.
+
+    All of gcc's diagnostics are compared, not just the unknown names, so an
+    include that only supplies e.g. struct member macros is kept.
+    """
+    kept = set(files)
+    messages = diagnostics.messages
+    for file in sorted(files):
+        candidate = check_file(bhv_file, source, kept - {file}).messages
+        if candidate <= messages:
+            kept.discard(file)
+            messages = candidate
+    return kept
+
+
+def resolve_to_fixed_point(bhv_files: List[Path], jobs: int) -> Dict[Path, Set[str]]:
+    """Add includes until no file gains any, then prune the redundant ones.
+
+    Each round only re-diagnoses the files whose includes changed in the
+    round before.
+    """
+    sources = {bhv_file: bhv_file.read_text() for bhv_file in bhv_files}
+    includes = {bhv_file: set(DEFAULT_INCLUDES) for bhv_file in bhv_files}
+    diagnostics: Dict[Path, Diagnostics] = {}
+
+    pending = bhv_files
+    round_number = 0
+    while pending:
+        round_number += 1
+        start = time.perf_counter()
+        results = parallel.ordered_map(
+            check_file,
+            [(f, sources[f], includes[f]) for f in pending],
+            jobs,
+            threads=True,
+        )
+        changed = []
+        for bhv_file, result in zip(pending, results):
+            diagnostics[bhv_file] = result
+            new_files = (
+                resolve_includes(result.symbols, result.functions) - includes[bhv_file]
+            )
+            if new_files:
+                includes[bhv_file] |= new_files
+                changed.append(bhv_file)
+        print(
+            f"round {round_number}: checked {len(pending)} files, "
+            f"{len(changed)} changed, {time.perf_counter() - start:.2f}s"
+        )
+        pending = changed
+
+    start = time.perf_counter()
+    pruned = parallel.ordered_map(
+        prune_includes,
+        [(f, sources[f], includes[f], diagnostics[f]) for f in bhv_files],
+        jobs,
+        threads=True,
+    )
+    for bhv_file, kept in zip(bhv_files, pruned):
+        includes[bhv_file] = kept
+    print(f"prune: checked {len(bhv_files)} files, {time.perf_counter() - start:.2f}s")
+    return includes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Prepend the includes each behavior file is missing."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of gcc passes to run at once",
+    )
+    parser.add_argument(
+        "--fixed-point",
+        action="store_true",
+        help="re-diagnose files until their includes stop changing, then prune",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the edits without applying them"
+    )
+    args = parser.parse_args()
+
+    plan = EditPlan()
+    bhv_files = sorted((Path("./src") / "game" / "behaviors").iterdir())
+    if args.fixed_point:
+        for bhv_file, files in resolve_to_fixed_point(bhv_files, args.jobs).items():
+            print(bhv_file)
+            print("\n".join(sorted(get_print_includes(files))))
+            plan.insert_lines(bhv_file, sorted(get_print_includes(files)))
+    else:
+        unknown_names = parallel.ordered_map(
+            get_unknown_names, [(f,) for f in bhv_files], args.jobs, threads=True
+        )
+        for bhv_file, names in zip(bhv_files, unknown_names):
+            files = DEFAULT_INCLUDES | resolve_includes(*names)
+
+            includes = get_print_includes(files)
+            print(bhv_file)
+            print("\n".join(sorted(includes)))
+
+            plan.insert_lines(bhv_file, sorted(includes))
+    plan.apply(args.dry_run)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3.8
+"""Rough timings of the in-process helpers against the tools they replace."""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import elf
+import mio0
+import rom_diff
+import text_extract
+from rom import Rom
+
+
+def timed(label: str, func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {elapsed:.3f}s")
+    return elapsed
+
+
+def get_o_files(sm64_source: str, version: str) -> List[Path]:
+    return sorted((Path(sm64_source) / "build" / version).rglob("*.o"))
+
+
+def bench_elf(args) -> None:
+    o_files = get_o_files(args.sm64_source, args.version)
+    print(f"{len(o_files)} object files")
+
+    def native():
+        for o_file in o_files:
+            elf_file = elf.ElfFile.from_path(o_file)
+            elf_file.defined_symbols(".data")
+            elf_file.undefined_symbols()
+            elf_file.hi_lo_pairs()
+
+    def objdump():
+        for o_file in o_files:
+            for flags in ("-t", "-rd"):
+                subprocess.run(
+                    ["mips-linux-gnu-objdump", flags, str(o_file)],
+                    stdout=subprocess.PIPE,
+                )
+
+    native_time = timed("native ELF reader", native)
+    if shutil.which("mips-linux-gnu-objdump") is None:
+        print("mips-linux-gnu-objdump not found, skipping")
+        return
+    objdump_time = timed("objdump -t / -rd", objdump)
+    print(f"speedup: {objdump_time / native_time:.1f}x")
+
+
+def bench_text(args) -> None:
+    charmap_path = str(Path(args.sm64_source) / "charmap.txt")
+    strings: List[bytes] = []
+    for bank_name, bank in text_extract.TEXT_BANKS.items():
+        data = text_extract.get_bank_data(bank, args.sm64_source)
+        end = min(bank.offset + bank.length, len(data))
+        bank_strings = [
+            string
+            for _, _, string in text_extract.iter_interleaved(
+                text_extract.iter_strings(data, bank.offset, end),
+                bank.triplet_ranges,
+            )
+        ]
+        print(f"{bank_name}: {len(bank_strings)} strings")
+        strings += bank_strings
+    print(f"{sum(len(string) for string in strings)} bytes of text")
+
+    def per_byte():
+        # What text_extract.charmap used to do: reread charmap.txt per byte.
+        for string in strings:
+            for c in text_extract.chunks(string, 1):
+                int_val = int.from_bytes(c, "big")
+                for map_line in Path(charmap_path).read_text().split("\n"):
+                    if not map_line or map_line.startswith("#"):
+                        continue
+                    text, val = map_line.split(" = ")
+                    if val == f"0x{int_val:0>2X}":
+                        pass
+
+    def table():
+        text_extract.load_charmap.cache_clear()
+        for string in strings:
+            text_extract.decode(string, charmap_path)
+
+    table_time = timed("lookup table", table)
+    per_byte_time = timed("per-byte charmap", per_byte)
+    print(f"speedup: {per_byte_time / table_time:.0f}x")
+
+
+def bench_mio0(args) -> None:
+    rom = Rom.open(Path(args.sm64_source) / f"baserom.{args.version}.z64")
+    offsets = mio0.find_blocks(rom)
+    print(f"{len(offsets)} MIO0 blocks")
+
+    outputs: Dict[int, bytes] = {}
+
+    def native():
+        for offset in offsets:
+            outputs[offset] = mio0.decompress(rom[offset:])
+
+    native_time = timed("mio0.decompress", native)
+    total = sum(len(data) for data in outputs.values())
+    print(f"{total / native_time / 1e6:.1f} MB/s decompressed")
+
+    sm64tools = os.environ.get("SM64_TOOLS")
+    if not sm64tools or not (Path(sm64tools) / "mio0").is_file():
+        print("$SM64_TOOLS/mio0 not found, skipping reference comparison")
+        return
+
+    mismatches = []
+    with tempfile.TemporaryDirectory() as tmp:
+
+        def reference():
+            for offset in offsets:
+                out = Path(tmp) / f"{offset:x}.bin"
+                subprocess.run(
+                    [
+                        str(Path(sm64tools) / "mio0"),
+                        "-d",
+                        "-o",
+                        hex(offset),
+                        str(rom.path),
+                        str(out),
+                    ],
+                    stdout=subprocess.DEVNULL,
+                )
+                if out.read_bytes() != outputs[offset]:
+                    mismatches.append(offset)
+
+        reference_time = timed("sm64tools mio0 -d", reference)
+    print(f"speedup: {reference_time / native_time:.1f}x")
+    for offset in mismatches:
+        print(f"output differs from the reference tool at {offset:#x}")
+
+
+def bench_diff(args) -> None:
+    locations: List[rom_diff.DiffLocation] = []
+
+    def native():
+        locations[:] = rom_diff.diff_roms(args.sm64_source, args.version)
+
+    native_time = timed("rom_diff.diff_roms", native)
+    print(f"{len(locations)} differing ranges")
+
+    first_diff = Path(args.sm64_source) / "first-diff.py"
+    if not first_diff.is_file():
+        print("first-diff.py not found, skipping")
+        return
+    first_diff_time = timed(
+        "first-diff.py",
+        lambda: subprocess.run(
+            [str(first_diff)], cwd=args.sm64_source, stdout=subprocess.DEVNULL
+        ),
+    )
+    print(f"speedup: {first_diff_time / native_time:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sm64_source", help="Path to sm64_source")
+    parser.add_argument("--version", default="eu", help="Build version to use")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    subparsers.add_parser("elf", help="ELF reader vs objdump").set_defaults(
+        func=bench_elf
+    )
+    subparsers.add_parser(
+        "text", help="charmap decoding of the text banks"
+    ).set_defaults(func=bench_text)
+    subparsers.add_parser("mio0", help="MIO0 decompression").set_defaults(
+        func=bench_mio0
+    )
+    subparsers.add_parser("diff", help="ROM diff vs first-diff.py").set_defaults(
+        func=bench_diff
+    )
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3.8
+"""Format ROM ranges as C array initializers.
+
+Values are formatted through precomputed hex tables and the whole array is
+built up before a single write, so multi-megabyte blobs dump quickly.
+"""
+import argparse
+import sys
+from array import array
+from functools import lru_cache
+from typing import List, Optional, TextIO
+
+from rom import Rom
+
+ELEMENT_TYPES = {"u8": "B", "u16": "H", "u32": "I"}
+
+HEX_U8 = [f"0x{i:02X}" for i in range(0x100)]
+
+
+@lru_cache(maxsize=None)
+def hex_u16_digits() -> List[str]:
+    return [f"{i:04X}" for i in range(0x10000)]
+
+
+def format_elements(data, ctype: str = "u8") -> List[str]:
+    """Hex literals for data read as big-endian ctype elements."""
+    if ctype == "u8":
+        return list(map(HEX_U8.__getitem__, bytes(data)))
+
+    values = array(ELEMENT_TYPES[ctype])
+    if len(data) % values.itemsize:
+        raise Exception(
+            f"{len(data):#x} bytes isn't a whole number of {ctype} elements"
+        )
+    values.frombytes(bytes(data))
+    if sys.byteorder == "little":
+        values.byteswap()
+    digits = hex_u16_digits()
+    if ctype == "u16":
+        return ["0x" + digits[value] for value in values]
+    return ["0x" + digits[value >> 16] + digits[value & 0xFFFF] for value in values]
+
+
+def format_array(
+    data, ctype: str = "u8", per_line: int = 8, name: Optional[str] = None
+) -> str:
+    """A C initializer for data, or a full definition if name is given."""
+    elements = format_elements(data, ctype)
+    lines = [
+        "    " + ", ".join(elements[i : i + per_line]) + ","
+        for i in range(0, len(elements), per_line)
+    ]
+    body = "{\n" + "\n".join(lines) + "\n}"
+    if name is None:
+        return body + "\n"
+    return f"{ctype} {name}[] = {body};\n"
+
+
+def write_array(
+    out: TextIO,
+    data,
+    ctype: str = "u8",
+    per_line: int = 8,
+    name: Optional[str] = None,
+) -> None:
+    out.write(format_array(data, ctype, per_line, name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rom", help="ROM (or any binary) to read from")
+    parser.add_argument("start", type=lambda x: int(x, 0), help="Start offset")
+    parser.add_argument("end", type=lambda x: int(x, 0), help="End offset")
+    parser.add_argument("--type", choices=list(ELEMENT_TYPES), default="u8")
+    parser.add_argument("--width", type=int, default=8, help="Values per line")
+    parser.add_argument("--name", help="Emit a full definition with this name")
+    parser.add_argument("-o", "--output", help="File to write, e.g. foo.inc.c")
+    args = parser.parse_args()
+    if (args.end - args.start) % array(ELEMENT_TYPES[args.type]).itemsize:
+        parser.error(f"{args.start:#x}-{args.end:#x} doesn't hold whole {args.type}s")
+
+    data = Rom.open(args.rom)[args.start : args.end]
+    if args.output:
+        with open(args.output, "w") as out:
+            write_array(out, data, args.type, args.width, args.name)
+    else:
+        write_array(sys.stdout, data, args.type, args.width, args.name)
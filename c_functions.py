@@ -0,0 +1,178 @@
+"""Locate C function definitions without compiling anything.
+
+Each source is tokenized once: comments, string and character literals and
+preprocessor lines are skipped over, and brace depth is tracked so nested
+blocks inside a body don't end the function early.
+"""
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<literal>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    |(?P<directive>^[ \t]*\#(?:\\\n|[^\n])*)
+    |(?P<ident>[A-Za-z_]\w*)
+    |(?P<punct>[{}();])
+    """,
+    re.DOTALL | re.MULTILINE | re.VERBOSE,
+)
+
+DIRECTIVE_RE = re.compile(r"[ \t]*#[ \t]*(\w*)")
+
+EU_GUARD = "#if defined(VERSION_EU) && !defined(NON_MATCHING)"
+
+
+class CFunction(NamedTuple):
+    name: str
+    # (start, end) character offsets into the source; the signature runs through
+    # the closing parenthesis and the body from the opening brace to its match.
+    signature: Tuple[int, int]
+    body: Tuple[int, int]
+
+
+def find_functions(source: str) -> Dict[str, CFunction]:
+    """Every top-level function definition in source, by name.
+
+    A name defined more than once (e.g. under #if/#else) maps to its first
+    definition. Every arm of a conditional is scanned from the state at its
+    #if, and scanning carries on after #endif from the end of the first arm,
+    so braces opened or closed in each arm are only counted once.
+
+    >>> sorted(find_functions("int f(void) { if (1) { g(); } }"))
+    ['f']
+    >>> sorted(find_functions('void f(void) { puts("}"); }\\nvoid g(void) {}'))
+    ['f', 'g']
+    >>> sorted(find_functions('GLOBAL_ASM("a.s")\\nvoid qux(void) {}'))
+    ['qux']
+    >>> sorted(find_functions("void h(void) { int c = '}'; /* } */ }\\nint k(void);"))
+    ['h']
+    >>> sorted(find_functions(
+    ...     "void f(int a, int b) {\\n#ifdef VERSION_EU\\n    if (a) {\\n#else\\n"
+    ...     "    if (b) {\\n#endif\\n    }\\n}\\nvoid h(void) {}\\n"
+    ... ))
+    ['f', 'h']
+    >>> sorted(find_functions(
+    ...     "void f(int a) {\\n    if (a) {\\n#ifdef VERSION_EU\\n    }\\n#else\\n"
+    ...     "    }\\n#endif\\n}\\nvoid h(void) {}\\n"
+    ... ))
+    ['f', 'h']
+    """
+    functions: Dict[str, CFunction] = {}
+    depth = 0
+    parens = 0
+    decl_start = -1
+    body_start = -1
+    sig_end = -1
+    name = ""
+    prev = ""
+    prev_end = -1
+    prev_kind = ""
+    # For each open #if: the state at the #if, and at the end of its first arm.
+    conditionals: List[List[Optional[tuple]]] = []
+    for token in TOKEN_RE.finditer(source):
+        kind = token.lastgroup
+        text = token.group()
+        if kind == "comment":
+            continue
+
+        if kind == "directive":
+            keyword = DIRECTIVE_RE.match(text).group(1)
+            state = (depth, parens, decl_start, body_start, sig_end, name)
+            state += (prev, prev_end, prev_kind)
+            if keyword in ("if", "ifdef", "ifndef"):
+                conditionals.append([state, None])
+                continue
+            if keyword in ("elif", "else") and conditionals:
+                if conditionals[-1][1] is None:
+                    conditionals[-1][1] = state
+                restored = conditionals[-1][0]
+            elif keyword == "endif" and conditionals:
+                restored = conditionals.pop()[1] or state
+            else:
+                if depth == 0:
+                    decl_start, name, parens = -1, "", 0
+                    prev, prev_kind = "", ""
+                continue
+            depth, parens, decl_start, body_start, sig_end, name = restored[:6]
+            prev, prev_end, prev_kind = restored[6:]
+            continue
+
+        if depth > 0:
+            if text == "{":
+                depth += 1
+            elif text == "}":
+                depth -= 1
+                if depth == 0 and body_start != -1:
+                    functions.setdefault(
+                        name,
+                        CFunction(
+                            name, (decl_start, sig_end), (body_start, token.end())
+                        ),
+                    )
+                    decl_start, body_start, name = -1, -1, ""
+            prev, prev_kind = text, kind
+            continue
+
+        if decl_start == -1 or (kind == "ident" and prev == ")" and parens == 0):
+            # An identifier can't follow a complete declarator, so e.g. a
+            # bare GLOBAL_ASM(...) line ended and something new starts here.
+            decl_start, name = token.start(), ""
+        if text == "(":
+            if parens == 0 and not name and prev_kind == "ident":
+                name = prev
+            parens += 1
+        elif text == ")":
+            parens = max(parens - 1, 0)
+        elif text == ";" and parens == 0:
+            decl_start, name = -1, ""
+        elif text == "{":
+            depth = 1
+            if parens == 0 and prev == ")" and name:
+                body_start = token.start()
+                sig_end = prev_end
+        prev, prev_kind, prev_end = text, kind, token.end()
+    return functions
+
+
+def _line_start(source: str, offset: int) -> int:
+    return source.rfind("\n", 0, offset) + 1
+
+
+def _line_end(source: str, offset: int) -> int:
+    end = source.find("\n", offset)
+    return len(source) if end == -1 else end + 1
+
+
+def wrap_functions(source: str, names: Iterable[str]) -> Tuple[str, List[str]]:
+    """Guard each named function with a GLOBAL_ASM stub for EU.
+
+    Returns the rewritten source and the names that were actually found.
+    """
+    functions = find_functions(source)
+    found = sorted(
+        (functions[name] for name in set(names) if name in functions),
+        key=lambda function: function.signature[0],
+    )
+
+    pieces = []
+    copied = 0
+    for function in found:
+        sig_start, sig_end = function.signature
+        start = _line_start(source, sig_start)
+        end = _line_end(source, function.body[1])
+        prototype = source[sig_start:sig_end]
+        pieces.append(source[copied:start])
+        pieces.append(
+            f"{EU_GUARD}\n"
+            f"{prototype};\n"
+            f'GLOBAL_ASM("asm/non_matchings/{function.name}_eu.s")\n'
+            "#else\n"
+        )
+        pieces.append(source[start:end])
+        if not pieces[-1].endswith("\n"):
+            pieces.append("\n")
+        pieces.append("#endif\n")
+        copied = end
+    pieces.append(source[copied:])
+    return "".join(pieces), [function.name for function in found]
@@ -0,0 +1,60 @@
+"""On-disk caching of values derived from a single input file.
+
+Entries are keyed by the input's path and validated by its mtime and size; if
+those changed, the file's SHA-1 decides whether the cached value still holds.
+"""
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import Any, Callable, TypeVar, Union
+
+T = TypeVar("T")
+
+CACHE_ROOT = Path(
+    os.environ.get("SM64_HELPERS_CACHE", Path.home() / ".cache" / "sm64_match_helpers")
+)
+
+
+def file_hash(path: Union[str, Path]) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _entry_path(namespace: str, path: Path) -> Path:
+    name = hashlib.sha1(str(path.resolve()).encode("utf-8")).hexdigest()
+    return CACHE_ROOT / namespace / f"{name}.pickle"
+
+
+def _store(entry: Path, value: Any) -> None:
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(entry)
+
+
+def cached_for_file(
+    namespace: str, path: Union[str, Path], build: Callable[[Path], T]
+) -> T:
+    """Return build(path), reusing the on-disk result while path is unchanged."""
+    path = Path(path)
+    stat = path.stat()
+    entry = _entry_path(namespace, path)
+
+    digest = None
+    try:
+        with open(entry, "rb") as f:
+            mtime_ns, size, cached_digest, value = pickle.load(f)
+        if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size):
+            return value
+        digest = file_hash(path)
+        if digest == cached_digest:
+            _store(entry, (stat.st_mtime_ns, stat.st_size, digest, value))
+            return value
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+
+    value = build(path)
+    _store(entry, (stat.st_mtime_ns, stat.st_size, digest or file_hash(path), value))
+    return value
@@ -0,0 +1,143 @@
+"""A shared, batching front end to sm64tools' mipsdisasm.
+
+Callers ask for ROM ranges from any thread; requests that arrive within a
+short window are coalesced into one mipsdisasm run per ROM, and every decoded
+word is kept so repeated lookups never start another process.
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+LINE_RE = re.compile(r"^/\* [0-9A-Fa-f]+ [0-9A-Fa-f]+ ([0-9A-Fa-f]{8}) \*/")
+
+
+class Disassembler:
+    def __init__(
+        self,
+        sm64tools: str,
+        vram: int = 0x80200000,
+        batch_window: float = 0.005,
+        merge_gap: int = 0x100,
+    ):
+        self.mipsdisasm = str(Path(sm64tools) / "mipsdisasm")
+        self.vram = vram
+        self.batch_window = batch_window
+        self.merge_gap = merge_gap
+
+        self._decoded: Dict[str, Dict[int, int]] = {}
+        self._pending: List[Tuple[str, int, int, Future]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def submit(self, rom: str, offset: int, length: int = 4) -> Future:
+        """Future for the words covering [offset, offset + length)."""
+        future: Future = Future()
+        with self._lock:
+            decoded = self._decoded.get(rom, {})
+            if all(off in decoded for off in range(offset, offset + length, 4)):
+                future.set_result(
+                    [decoded[off] for off in range(offset, offset + length, 4)]
+                )
+                return future
+            self._pending.append((rom, offset, length, future))
+        self._wakeup.set()
+        return future
+
+    def get_words(self, rom: str, offset: int, length: int) -> List[int]:
+        return self.submit(rom, offset, length).result()
+
+    def _serve(self) -> None:
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.batch_window)
+            with self._lock:
+                self._wakeup.clear()
+                pending, self._pending = self._pending, []
+
+            by_rom: Dict[str, List[Tuple[int, int, Future]]] = {}
+            for rom, offset, length, future in pending:
+                by_rom.setdefault(rom, []).append((offset, length, future))
+            for rom, requests in by_rom.items():
+                error: Optional[Exception] = None
+                try:
+                    self._disassemble(
+                        rom, [(off, length) for off, length, _ in requests]
+                    )
+                except Exception as e:
+                    error = e
+                decoded = self._decoded.get(rom, {})
+                for offset, length, future in requests:
+                    offsets = range(offset, offset + length, 4)
+                    if error is not None:
+                        future.set_exception(error)
+                    elif any(off not in decoded for off in offsets):
+                        future.set_exception(
+                            Exception(f"mipsdisasm gave nothing for {rom}:{offset:#x}")
+                        )
+                    else:
+                        future.set_result([decoded[off] for off in offsets])
+
+    def _coalesce(self, ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        merged: List[Tuple[int, int]] = []
+        for start, length in sorted(ranges):
+            end = start + length
+            if merged and start <= merged[-1][1] + self.merge_gap:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return [(start, end - start) for start, end in merged]
+
+    def _disassemble(self, rom: str, ranges: List[Tuple[int, int]]) -> None:
+        ranges = self._coalesce(ranges)
+        output = subprocess.run(
+            [
+                self.mipsdisasm,
+                "-p",
+                rom,
+                *(f"{self.vram:#x}:{start:#x}+{length:#x}" for start, length in ranges),
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8")
+
+        # Instruction lines come out in range order, one per word.
+        offsets = (
+            offset
+            for start, length in ranges
+            for offset in range(start, start + length, 4)
+        )
+        decoded: Dict[int, int] = {}
+        for line in output.split("\n"):
+            match = LINE_RE.match(line)
+            if not match:
+                continue
+            offset = next(offsets, None)
+            if offset is None:
+                break
+            decoded[offset] = int(match.group(1), 16)
+
+        with self._lock:
+            self._decoded.setdefault(rom, {}).update(decoded)
+
+
+_disassembler: Optional[Disassembler] = None
+
+
+def get_disassembler() -> Disassembler:
+    """The process-wide Disassembler, using $SM64_TOOLS/mipsdisasm."""
+    global _disassembler
+    if _disassembler is None:
+        sm64_tools = os.environ.get("SM64_TOOLS")
+        if not sm64_tools:
+            raise EnvironmentError(
+                "Env variable SM64_TOOLS should point to "
+                "sm64tools checkout with mipsdisasm built"
+            )
+        _disassembler = Disassembler(sm64_tools)
+    return _disassembler
@@ -0,0 +1,106 @@
+"""Collect file edits in memory and apply them all at once.
+
+Edits to the same file are coalesced, so every file is read and written at
+most once. A plan can be printed instead of applied (dry run); applying it
+writes each file through a temporary file and a rename, and only removes
+the sources of moves once everything else is in place, so an interrupted
+run can simply be started again.
+"""
+import difflib
+import os
+from pathlib import Path
+from typing import Dict, List, Union
+
+PathLike = Union[str, Path]
+
+
+def atomic_write(path: PathLike, data: bytes) -> None:
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class EditPlan:
+    def __init__(self):
+        self.originals: Dict[Path, bytes] = {}
+        self.contents: Dict[Path, bytes] = {}
+        self.moves: Dict[Path, Path] = {}
+        self.deletions: List[Path] = []
+
+    def read_bytes(self, path: PathLike) -> bytes:
+        """The file as it will be once the plan is applied."""
+        path = Path(path)
+        if path in self.contents:
+            return self.contents[path]
+        if path not in self.originals:
+            self.originals[path] = path.read_bytes() if path.exists() else b""
+        return self.originals[path]
+
+    def read_text(self, path: PathLike) -> str:
+        return self.read_bytes(path).decode("utf-8")
+
+    def write_bytes(self, path: PathLike, data: bytes) -> None:
+        path = Path(path)
+        self.read_bytes(path)
+        self.contents[path] = data
+
+    def write_text(self, path: PathLike, text: str) -> None:
+        self.write_bytes(path, text.encode("utf-8"))
+
+    def insert_lines(self, path: PathLike, lines: List[str]) -> None:
+        """Put lines at the top of a file."""
+        self.write_text(path, "\n".join(lines + self.read_text(path).split("\n")))
+
+    def move(self, src: PathLike, dest: PathLike) -> None:
+        self.moves[Path(src)] = Path(dest)
+
+    def delete(self, path: PathLike) -> None:
+        self.deletions.append(Path(path))
+
+    def changed_files(self) -> List[Path]:
+        return sorted(
+            path
+            for path, data in self.contents.items()
+            if data != self.originals.get(path)
+        )
+
+    def describe(self, diffs: bool = True) -> List[str]:
+        lines = [f"move {src} -> {dest}" for src, dest in self.moves.items()]
+        lines += [f"delete {path}" for path in self.deletions]
+        for path in self.changed_files():
+            lines.append(f"edit {path}")
+            if not diffs:
+                continue
+            old = self.originals[path].decode("utf-8", errors="replace")
+            new = self.contents[path].decode("utf-8", errors="replace")
+            lines += [
+                line.rstrip("\n")
+                for line in difflib.unified_diff(
+                    old.splitlines(True),
+                    new.splitlines(True),
+                    str(path),
+                    str(path),
+                )
+            ]
+        return lines
+
+    def apply(self, dry_run: bool = False) -> None:
+        """Carry out the plan, or just print it."""
+        if dry_run:
+            print("\n".join(self.describe()))
+            return
+
+        # Copy first and remove the sources last: a rerun after an
+        # interruption still finds every source where it expects it.
+        for src, dest in self.moves.items():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(dest, src.read_bytes())
+        for path in self.changed_files():
+            atomic_write(path, self.contents[path])
+        for path in self.deletions + list(self.moves):
+            if path.exists():
+                path.unlink()
+
+        self.originals.update((path, self.contents[path]) for path in self.contents)
+        self.moves, self.deletions = {}, []
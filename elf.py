@@ -0,0 +1,241 @@
+"""A small reader for the big-endian ELF32 relocatable objects the build emits.
+
+Symbol tables and REL sections are decoded into parallel arrays rather than
+one object per entry, so hundreds of objects can be loaded in one process.
+"""
+import struct
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import cache
+
+SHT_SYMTAB = 2
+SHT_REL = 9
+
+SHN_UNDEF = 0
+
+STT_SECTION = 3
+
+R_MIPS_HI16 = 5
+R_MIPS_LO16 = 6
+
+
+class Section:
+    __slots__ = ("name", "type", "offset", "size", "link", "info", "entsize")
+
+    def __init__(
+        self,
+        name: str,
+        type: int,
+        offset: int,
+        size: int,
+        link: int,
+        info: int,
+        entsize: int,
+    ):
+        self.name = name
+        self.type = type
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.info = info
+        self.entsize = entsize
+
+
+class Symbol:
+    __slots__ = ("name", "value", "size", "info", "shndx")
+
+    def __init__(self, name: str, value: int, size: int, info: int, shndx: int):
+        self.name = name
+        self.value = value
+        self.size = size
+        self.info = info
+        self.shndx = shndx
+
+    @property
+    def is_section(self) -> bool:
+        return self.info & 0xF == STT_SECTION
+
+
+class SymbolTable:
+    """The symtab as parallel arrays, indexed by symbol number."""
+
+    __slots__ = ("names", "values", "sizes", "infos", "shndxs")
+
+    def __init__(self):
+        self.names: List[str] = []
+        self.values = array("I")
+        self.sizes = array("I")
+        self.infos = array("B")
+        self.shndxs = array("H")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index: int) -> Symbol:
+        return Symbol(
+            self.names[index],
+            self.values[index],
+            self.sizes[index],
+            self.infos[index],
+            self.shndxs[index],
+        )
+
+
+class RelocationTable:
+    """REL entries of one section as parallel arrays, in file order."""
+
+    __slots__ = ("offsets", "types", "symbols")
+
+    def __init__(self):
+        self.offsets = array("I")
+        self.types = array("B")
+        self.symbols = array("I")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        return zip(self.offsets, self.types, self.symbols)
+
+
+class ElfFile:
+    def __init__(self, data: bytes):
+        if data[:4] != b"\x7fELF" or data[4] != 1 or data[5] != 2:
+            raise Exception("not a big-endian ELF32 file")
+        self.data = data
+
+        (shoff,) = struct.unpack_from(">I", data, 0x20)
+        shentsize, shnum, shstrndx = struct.unpack_from(">HHH", data, 0x2E)
+        headers = [
+            struct.unpack_from(">IIIIIIIIII", data, shoff + i * shentsize)
+            for i in range(shnum)
+        ]
+        shstrtab_offset = headers[shstrndx][4]
+        self.sections: List[Section] = [
+            Section(
+                self._string(shstrtab_offset, name),
+                type,
+                offset,
+                size,
+                link,
+                info,
+                entsize,
+            )
+            for name, type, _, _, offset, size, link, info, _, entsize in headers
+        ]
+        self._symbols: Optional[SymbolTable] = None
+
+    @classmethod
+    def from_path(cls, path: Union[str, Path]) -> "ElfFile":
+        return cls(Path(path).read_bytes())
+
+    def _string(self, table_offset: int, offset: int) -> str:
+        start = table_offset + offset
+        return self.data[start : self.data.index(b"\0", start)].decode("utf-8")
+
+    def section(self, name: str) -> Optional[Section]:
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    @property
+    def symbols(self) -> SymbolTable:
+        """The symbol table; section symbols are named after their section."""
+        if self._symbols is not None:
+            return self._symbols
+
+        table = SymbolTable()
+        for symtab in self.sections:
+            if symtab.type != SHT_SYMTAB:
+                continue
+            strtab_offset = self.sections[symtab.link].offset
+            entries = self.data[symtab.offset : symtab.offset + symtab.size]
+            for name, value, size, info, _, shndx in struct.iter_unpack(
+                ">IIIBBH", entries
+            ):
+                if info & 0xF == STT_SECTION and shndx < len(self.sections):
+                    table.names.append(self.sections[shndx].name)
+                else:
+                    table.names.append(self._string(strtab_offset, name))
+                table.values.append(value)
+                table.sizes.append(size)
+                table.infos.append(info)
+                table.shndxs.append(shndx)
+            break
+        self._symbols = table
+        return table
+
+    def symbol_names(self) -> List[str]:
+        return self.symbols.names
+
+    def defined_symbols(self, section_name: str) -> List[str]:
+        """Names of the non-section symbols defined in a section."""
+        shndxs = {i for i, s in enumerate(self.sections) if s.name == section_name}
+        table = self.symbols
+        return [
+            table.names[i]
+            for i in range(len(table))
+            if table.shndxs[i] in shndxs and table.infos[i] & 0xF != STT_SECTION
+        ]
+
+    def undefined_symbols(self) -> List[str]:
+        table = self.symbols
+        return [
+            table.names[i] for i in range(1, len(table)) if table.shndxs[i] == SHN_UNDEF
+        ]
+
+    def relocations(self, section_name: str = ".text") -> RelocationTable:
+        """Every REL entry that applies to a section."""
+        relocs = RelocationTable()
+        for rel in self.sections:
+            if rel.type != SHT_REL or self.sections[rel.info].name != section_name:
+                continue
+            entries = self.data[rel.offset : rel.offset + rel.size]
+            for offset, info in struct.iter_unpack(">II", entries):
+                relocs.offsets.append(offset)
+                relocs.types.append(info & 0xFF)
+                relocs.symbols.append(info >> 8)
+        return relocs
+
+    def hi_lo_pairs(
+        self, section_name: str = ".text"
+    ) -> Dict[str, List[Tuple[int, int]]]:
+        """Map symbol name to (HI16 offset, LO16 offset) pairs within a section.
+
+        Every LO16 is paired with the HI16s for the same symbol that precede it;
+        LO16s that follow an already paired HI16 reuse the last one.
+        """
+        names = self.symbol_names()
+        pending: Dict[str, List[int]] = {}
+        last_hi: Dict[str, int] = {}
+        pairs: Dict[str, List[Tuple[int, int]]] = {}
+        for offset, rel_type, sym_index in self.relocations(section_name):
+            symbol = names[sym_index]
+            if rel_type == R_MIPS_HI16:
+                pending.setdefault(symbol, []).append(offset)
+            elif rel_type == R_MIPS_LO16:
+                his = pending.pop(symbol, [])
+                if his:
+                    last_hi[symbol] = his[-1]
+                elif symbol in last_hi:
+                    his = [last_hi[symbol]]
+                for hi in his:
+                    pairs.setdefault(symbol, []).append((hi, offset))
+        return pairs
+
+
+@lru_cache(maxsize=None)
+def get_elf(o_file: str) -> ElfFile:
+    return ElfFile.from_path(o_file)
+
+
+@lru_cache(maxsize=None)
+def get_hi_lo_pairs(o_file: str) -> Dict[str, List[Tuple[int, int]]]:
+    """The .text HI16/LO16 relocation index of an object, cached on disk."""
+    return cache.cached_for_file(
+        "relocs-v1", o_file, lambda path: ElfFile.from_path(path).hi_lo_pairs()
+    )
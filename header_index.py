@@ -0,0 +1,33 @@
+"""Scan headers for the names they declare.
+
+Each header is read once for #defines, typedefs, declarations and function
+prototypes; symbol_db keeps the results and rescans only changed headers.
+"""
+import re
+from pathlib import Path
+from typing import Dict, List
+
+COMMENT = r"/\*(?:\*(?!/)|[^*])*\*/"
+DEFINE_RE = re.compile(rf"^(?:\s|{COMMENT})*#define\s(?:{COMMENT})*\s*(\w+)\s")
+TYPEDEF_RE = re.compile(r"\s(\w+);")
+DECLARATION_RE = re.compile(r"(?<=[^=])\s\**(\w+)(?:\[.*?\])*;")
+PROTOTYPE_RE = re.compile(r"^[\w\s\*]*\w[\w\s\*]*[\s\*]+(\w+)\([^\(\)]*\);")
+
+KINDS = ("define", "typedef", "declaration", "function")
+
+Declarations = Dict[str, List[str]]
+
+
+def scan_header(path: Path) -> Declarations:
+    """Names declared in a header, by kind, one line at a time like grep."""
+    found: Declarations = {kind: [] for kind in KINDS}
+    for line in path.read_text(errors="replace").split("\n"):
+        if match := DEFINE_RE.match(line):
+            found["define"].append(match.group(1))
+        if (typedef := line.find("typedef")) != -1:
+            found["typedef"].extend(TYPEDEF_RE.findall(line, typedef))
+        if ";" in line:
+            found["declaration"].extend(DECLARATION_RE.findall(line, 1))
+            if match := PROTOTYPE_RE.match(line):
+                found["function"].append(match.group(1))
+    return found
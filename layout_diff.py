@@ -0,0 +1,139 @@
+#!/usr/bin/env python3.8
+"""Compare where every data/bss/rodata symbol lives in the baserom vs the build.
+
+Every object's %hi/%lo references are resolved against both ROMs, and the
+results are merged into one table sorted by baserom address so the first
+point where the two layouts diverge stands out.
+"""
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import elf
+import linker_map
+from order_bss import get_real_ram_addrs
+from result_store import ResultStore, object_key
+
+DATA_SECTIONS = {".data", ".rodata", ".bss", ".sdata", ".sbss", "COMMON"}
+
+
+def get_object_addrs(
+    sm64_source: str, o_file: Path, file_rom_start: str
+) -> Dict[str, Tuple[str, str]]:
+    """Both ROMs' addresses for every named symbol o_file has a %hi/%lo for."""
+    symbols = [
+        symbol
+        for symbol in elf.get_hi_lo_pairs(str(o_file))
+        if not symbol.startswith(".")
+    ]
+    return get_real_ram_addrs(sm64_source, symbols, o_file, file_rom_start)
+
+
+def get_data_symbols(lmap: linker_map.LinkerMap) -> Dict[str, str]:
+    """Symbol name -> section, for every symbol the map places in a data section."""
+    return {
+        symbol.name: lmap.inputs[symbol.input_index].section
+        for symbol in lmap.symbols
+        if lmap.inputs[symbol.input_index].section in DATA_SECTIONS
+    }
+
+
+def get_all_o_files_and_offsets(
+    sm64_source: str, lmap: linker_map.LinkerMap
+) -> List[Tuple[Path, str]]:
+    seen = set()
+    o_files_and_offsets = []
+    for segment in lmap.segments:
+        if segment.rom is None:
+            continue
+        for o_file, offset in linker_map.get_o_files_and_offsets(
+            sm64_source, segment.name
+        ):
+            if o_file not in seen:
+                seen.add(o_file)
+                o_files_and_offsets.append((o_file, offset))
+    return o_files_and_offsets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sm64_source", help="Path to sm64_source")
+    parser.add_argument("--format", choices=["json", "csv"], default="csv")
+    parser.add_argument("-o", "--output", help="Write the table here, not stdout")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Object files to process at once"
+    )
+    args = parser.parse_args()
+
+    lmap = linker_map.load_map(args.sm64_source)
+    data_symbols = get_data_symbols(lmap)
+    o_files_and_offsets = get_all_o_files_and_offsets(args.sm64_source, lmap)
+
+    store = ResultStore.for_source(args.sm64_source, "layout_diff")
+    all_addrs = store.map(
+        get_object_addrs,
+        [
+            (
+                o_file,
+                object_key(args.sm64_source, o_file, file_rom_start),
+                (args.sm64_source, o_file, file_rom_start),
+            )
+            for o_file, file_rom_start in o_files_and_offsets
+        ],
+        args.jobs,
+    )
+
+    rows: Dict[str, Dict[str, str]] = {}
+    for (o_file, _), addrs in zip(o_files_and_offsets, all_addrs):
+        for symbol, (baserom, builtrom) in addrs.items():
+            if symbol not in data_symbols:
+                continue
+            if symbol in rows:
+                if (rows[symbol]["baserom"], rows[symbol]["builtrom"]) != (
+                    baserom,
+                    builtrom,
+                ):
+                    print(
+                        f"inconsistent position info for {symbol}: "
+                        f"{rows[symbol]['baserom']}, {rows[symbol]['builtrom']} vs "
+                        f"{baserom}, {builtrom} in {o_file.name}",
+                        file=sys.stderr,
+                    )
+                continue
+            rows[symbol] = {
+                "symbol": symbol,
+                "section": data_symbols[symbol],
+                "baserom": baserom,
+                "builtrom": builtrom,
+                "diff": hex(int(baserom, 16) - int(builtrom, 16)),
+                "o_file": str(o_file),
+            }
+
+    table = sorted(rows.values(), key=lambda row: int(row["baserom"], 16))
+    first_divergence = next((row for row in table if row["diff"] != "0x0"), None)
+    if first_divergence:
+        print(
+            f"layouts first diverge at {first_divergence['symbol']} "
+            f"({first_divergence['baserom']} -> {first_divergence['builtrom']})",
+            file=sys.stderr,
+        )
+    else:
+        print(f"all {len(table)} symbols match", file=sys.stderr)
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    if args.format == "json":
+        json.dump(
+            {"first_divergence": first_divergence, "symbols": table}, out, indent=2
+        )
+        out.write("\n")
+    else:
+        writer = csv.DictWriter(
+            out, ["symbol", "section", "baserom", "builtrom", "diff", "o_file"]
+        )
+        writer.writeheader()
+        writer.writerows(table)
+    if args.output:
+        out.close()
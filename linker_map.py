@@ -0,0 +1,297 @@
+"""Parse the GNU ld map file into an indexed segment/section/object layout.
+
+The map is read in a single streaming pass and the result is cached on disk
+next to the other derived data, keyed by the map file's mtime and hash.
+"""
+import re
+import sys
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import cache
+
+SEGMENT_RE = re.compile(
+    r"^(\.\S+)(?:\s+0x(\w+)\s+0x(\w+)(?:\s+load address 0x(\w+))?)?\s*$"
+)
+INPUT_RE = re.compile(r"^ (\.\S+|COMMON)(?:\s+0x(\w+)\s+0x(\w+)\s+(\S.*))?$")
+CONTINUATION_RE = re.compile(
+    r"^\s+0x(\w+)\s+0x(\w+)(?:\s+load address 0x(\w+)|\s+(\S.*))?$"
+)
+SYMBOL_RE = re.compile(r"^\s+0x(\w+)\s+([A-Za-z_$][\w$.]*)$")
+
+# ld prints a load address for NOLOAD segments and .bss inputs too, but
+# nothing of theirs is in the ROM.
+NOLOAD_SUFFIX = ".noload"
+NOLOAD_SECTIONS = (".bss", ".sbss", "COMMON")
+
+
+class Segment(NamedTuple):
+    name: str
+    ram: int
+    size: int
+    rom: Optional[int]
+
+
+class InputSection(NamedTuple):
+    segment: str
+    section: str
+    ram: int
+    size: int
+    rom: Optional[int]
+    object_name: str
+
+
+class MapSymbol(NamedTuple):
+    name: str
+    ram: int
+    rom: Optional[int]
+    input_index: int
+
+
+class LinkerMap:
+    def __init__(
+        self,
+        segments: List[Segment],
+        inputs: List[InputSection],
+        symbols: List[MapSymbol],
+    ):
+        self.segments = segments
+        self.inputs = inputs
+        self.symbols = symbols
+
+        self._segments_by_name = {segment.name: segment for segment in segments}
+        self._inputs_by_segment: Dict[str, List[int]] = {}
+        for i, input_section in enumerate(inputs):
+            self._inputs_by_segment.setdefault(input_section.segment, []).append(i)
+
+        self._ram_index = self._interval_index(
+            [(inp.ram, inp.size, i) for i, inp in enumerate(inputs)]
+        )
+        self._rom_index = self._interval_index(
+            [
+                (inp.rom, inp.size, i)
+                for i, inp in enumerate(inputs)
+                if inp.rom is not None
+            ]
+        )
+
+    @staticmethod
+    def _interval_index(
+        intervals: List[Tuple[int, int, int]],
+    ) -> Tuple[List[int], List[Tuple[int, int, int]]]:
+        intervals = sorted(interval for interval in intervals if interval[1] > 0)
+        return [start for start, _, _ in intervals], intervals
+
+    @staticmethod
+    def _lookup(
+        index: Tuple[List[int], List[Tuple[int, int, int]]], addr: int
+    ) -> Optional[int]:
+        starts, intervals = index
+        pos = bisect_right(starts, addr) - 1
+        if pos < 0:
+            return None
+        start, size, input_index = intervals[pos]
+        return input_index if addr < start + size else None
+
+    def segment(self, name: str) -> Segment:
+        if name not in self._segments_by_name:
+            raise Exception(f"no segment named {name} in the map file")
+        return self._segments_by_name[name]
+
+    def inputs_in(
+        self, segment: str, section: Optional[str] = ".text"
+    ) -> Iterator[InputSection]:
+        """Input sections of a segment in link order, optionally of one kind."""
+        self.segment(segment)
+        for i in self._inputs_by_segment.get(segment, []):
+            if section is None or self.inputs[i].section == section:
+                yield self.inputs[i]
+
+    def find_input(self, object_suffix: str) -> Optional[InputSection]:
+        """The first input section whose object path ends with object_suffix."""
+        for input_section in self.inputs:
+            if input_section.object_name.endswith(object_suffix):
+                return input_section
+        return None
+
+    def input_at_ram(self, addr: int) -> Optional[InputSection]:
+        """The input section covering a RAM address (overlays may share RAM)."""
+        i = self._lookup(self._ram_index, addr)
+        return None if i is None else self.inputs[i]
+
+    def input_at_rom(self, addr: int) -> Optional[InputSection]:
+        i = self._lookup(self._rom_index, addr)
+        return None if i is None else self.inputs[i]
+
+    def sized_symbols(
+        self, section: Optional[str] = ".text"
+    ) -> Iterator[Tuple[MapSymbol, int]]:
+        """(symbol, size) for every symbol in an input of a section, in link order.
+
+        A symbol runs up to the next one in its input section, so static
+        functions, which the map doesn't list, are folded into their neighbour;
+        aliases of the next symbol get size 0. For a function this is only an
+        upper bound on its size.
+        """
+        symbols_by_input: Dict[int, List[MapSymbol]] = {}
+        for symbol in self.symbols:
+            symbols_by_input.setdefault(symbol.input_index, []).append(symbol)
+
+        for input_index, symbols in sorted(symbols_by_input.items()):
+            input_section = self.inputs[input_index]
+            if section is not None and input_section.section != section:
+                continue
+            symbols = sorted(symbols, key=lambda symbol: symbol.ram)
+            ends = [symbol.ram for symbol in symbols[1:]]
+            ends.append(input_section.ram + input_section.size)
+            for symbol, end in zip(symbols, ends):
+                yield symbol, max(end - symbol.ram, 0)
+
+    def text_symbols(self) -> Iterator[Tuple[MapSymbol, int]]:
+        """sized_symbols for .text, without the empty ones."""
+        return ((symbol, size) for symbol, size in self.sized_symbols(".text") if size)
+
+
+def parse_map(map_path: Path) -> LinkerMap:
+    segments: List[Segment] = []
+    inputs: List[InputSection] = []
+    symbols: List[MapSymbol] = []
+
+    segment: Optional[Segment] = None
+    pending_segment: Optional[str] = None
+    pending_input: Optional[str] = None
+    in_memory_map = False
+
+    with open(map_path) as map_file:
+        for line in map_file:
+            line = line.rstrip("\n")
+            if not in_memory_map:
+                in_memory_map = line.startswith("Linker script and memory map")
+                continue
+            if not line.strip():
+                continue
+
+            if pending_segment is not None or pending_input is not None:
+                match = CONTINUATION_RE.match(line)
+                if match and pending_segment is not None:
+                    ram, size, load = match.group(1), match.group(2), match.group(3)
+                    segment = _segment(pending_segment, ram, size, load)
+                    segments.append(segment)
+                elif match and pending_input is not None and segment is not None:
+                    inputs.append(
+                        _input_section(segment, pending_input, *match.group(1, 2, 4))
+                    )
+                pending_segment = pending_input = None
+                if match:
+                    continue
+
+            if not line.startswith(" "):
+                segment = None
+                match = SEGMENT_RE.match(line)
+                if not match:
+                    continue
+                if match.group(2) is None:
+                    pending_segment = match.group(1)
+                    continue
+                segment = _segment(*match.groups())
+                segments.append(segment)
+                continue
+
+            if segment is None:
+                continue
+
+            match = INPUT_RE.match(line)
+            if match:
+                section, ram, size, object_name = match.groups()
+                if ram is None:
+                    pending_input = section
+                elif object_name is not None:
+                    inputs.append(
+                        _input_section(segment, section, ram, size, object_name)
+                    )
+                continue
+
+            match = SYMBOL_RE.match(line)
+            if match and inputs and inputs[-1].segment == segment.name:
+                ram = int(match.group(1), 16)
+                input_section = inputs[-1]
+                rom = (
+                    None
+                    if input_section.rom is None
+                    else input_section.rom + ram - input_section.ram
+                )
+                symbols.append(MapSymbol(match.group(2), ram, rom, len(inputs) - 1))
+
+    return LinkerMap(segments, inputs, symbols)
+
+
+def _segment(name: str, ram: str, size: str, load: Optional[str]) -> Segment:
+    rom = int(load, 16) if load and not name.endswith(NOLOAD_SUFFIX) else None
+    return Segment(name, int(ram, 16), int(size, 16), rom)
+
+
+def _input_section(
+    segment: Segment, section: str, ram: str, size: str, object_name: Optional[str]
+) -> InputSection:
+    ram_addr = int(ram, 16)
+    rom = None
+    if segment.rom is not None and not section.startswith(NOLOAD_SECTIONS):
+        rom = segment.rom + ram_addr - segment.ram
+    return InputSection(
+        segment.name, section, ram_addr, int(size, 16), rom, object_name or ""
+    )
+
+
+def get_map_path(sm64_source: str, version: str = "eu") -> Path:
+    return Path(sm64_source) / "build" / version / f"sm64.{version}.map"
+
+
+def load_map(sm64_source: str, version: str = "eu") -> LinkerMap:
+    return cache.cached_for_file(
+        "linker-map-v2", get_map_path(sm64_source, version), parse_map
+    )
+
+
+def object_path(sm64_source: str, object_name: str) -> Optional[Path]:
+    """The .o file on disk for a map input, looking inside libultra/libgoddard."""
+    sm64_path = Path(sm64_source)
+    match = re.match(r"(.*)\((.*)\)$", object_name)
+    if not match:
+        return sm64_path / object_name
+
+    archive, member = match.groups()
+    archive_dir = str(Path(archive).parent)
+    if archive.endswith("libultra.a"):
+        candidates = [
+            f"{archive_dir}/lib/src/{member}",
+            f"{archive_dir}/lib/asm/{member}",
+        ]
+    elif archive.endswith("libgoddard.a"):
+        candidates = [f"{archive_dir}/src/goddard/{member}"]
+    else:
+        candidates = []
+    for candidate in candidates:
+        if (maybe := sm64_path / candidate).is_file():
+            return maybe
+    return None
+
+
+def get_o_files_and_offsets(
+    sm64_source: str, segment: str = ".main", version: str = "eu"
+) -> List[Tuple[Path, str]]:
+    """(.o file, ROM offset of its .text) for every object linked into a segment."""
+    o_files_and_offsets = []
+    for input_section in load_map(sm64_source, version).inputs_in(segment, ".text"):
+        filepath = object_path(sm64_source, input_section.object_name)
+        if filepath is None:
+            print(
+                "can't figure out how to make this a real .o file: "
+                f"{input_section.object_name}",
+                file=sys.stderr,
+            )
+            continue
+        if input_section.rom is None:
+            raise Exception(f"{segment} has no load address in the map file")
+        o_files_and_offsets.append((filepath, hex(input_section.rom)))
+    return o_files_and_offsets
@@ -0,0 +1,80 @@
+"""MIO0 decompression straight from ROM memory, with an on-disk cache.
+
+Decompressed blocks are stored under the helpers' cache directory keyed by
+the ROM's SHA-1 and the block's offset, so each block is only ever inflated
+once per ROM.
+"""
+import struct
+from typing import List
+
+import cache
+from rom import Rom
+
+
+def decompress(data) -> bytes:
+    """Inflate the MIO0 block at the start of a bytes-like object."""
+    data = memoryview(data)
+    if bytes(data[:4]) != b"MIO0":
+        raise Exception("not a MIO0 block")
+    size, comp_offset, uncomp_offset = struct.unpack_from(">III", data, 4)
+
+    out = bytearray()
+    layout_pos = 0x10
+    bits = 0
+    bits_left = 0
+    while len(out) < size:
+        if bits_left == 0:
+            (bits,) = struct.unpack_from(">I", data, layout_pos)
+            layout_pos += 4
+            bits_left = 32
+        bits_left -= 1
+        if bits & (1 << bits_left):
+            out.append(data[uncomp_offset])
+            uncomp_offset += 1
+        else:
+            (pair,) = struct.unpack_from(">H", data, comp_offset)
+            comp_offset += 2
+            length = (pair >> 12) + 3
+            start = len(out) - (pair & 0xFFF) - 1
+            if length <= len(out) - start:
+                out += out[start : start + length]
+            else:
+                # Overlapping copy: the run repeats bytes it is producing.
+                for i in range(length):
+                    out.append(out[start + i])
+    return bytes(out[:size])
+
+
+def find_blocks(rom: Rom) -> List[int]:
+    """ROM offsets of everything that looks like a MIO0 header."""
+    offsets = []
+    pos = rom.find(b"MIO0")
+    while pos != -1:
+        if pos % 4 == 0:
+            size, comp_offset, uncomp_offset = struct.unpack_from(
+                ">III", rom.bytes_at(pos + 4, 12)
+            )
+            if 0x10 <= comp_offset <= uncomp_offset < len(rom) - pos and size:
+                offsets.append(pos)
+        pos = rom.find(b"MIO0", pos + 4)
+    return offsets
+
+
+def block_size(rom: Rom, offset: int) -> int:
+    """Decompressed size of the MIO0 block at offset."""
+    (size,) = struct.unpack_from(">I", rom.bytes_at(offset + 4, 4))
+    return size
+
+
+def decompress_cached(rom: Rom, offset: int) -> bytes:
+    rom_hash = cache.cached_for_file("rom-sha1", rom.path, cache.file_hash)
+    entry = cache.CACHE_ROOT / "mio0" / f"{rom_hash}-{offset:x}.bin"
+    if entry.is_file():
+        return entry.read_bytes()
+
+    data = decompress(rom[offset:])
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = entry.with_suffix(".tmp")
+    tmp.write_bytes(data)
+    tmp.replace(entry)
+    return data
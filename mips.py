@@ -0,0 +1,399 @@
+"""In-process decoding of MIPS instruction words read out of a ROM image.
+
+This replaces asking mipsdisasm to print one instruction at a time when all we
+want is the immediate field of a LUI/ADDIU/LW/SW/etc., and covers enough of
+the R4300 instruction set to disassemble compiled game functions.
+"""
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OP_ORI = 0x0D
+OP_LUI = 0x0F
+
+# Opcodes whose 16-bit immediate can be the %lo half of an address.
+LO16_OPCODES: Dict[int, str] = {
+    0x08: "addi",
+    0x09: "addiu",
+    0x0D: "ori",
+    0x20: "lb",
+    0x21: "lh",
+    0x23: "lw",
+    0x24: "lbu",
+    0x25: "lhu",
+    0x28: "sb",
+    0x29: "sh",
+    0x2B: "sw",
+    0x31: "lwc1",
+    0x35: "ldc1",
+    0x39: "swc1",
+    0x3D: "sdc1",
+}
+
+
+def opcode(word: int) -> int:
+    return word >> 26
+
+
+def rs(word: int) -> int:
+    return (word >> 21) & 0x1F
+
+
+def rt(word: int) -> int:
+    return (word >> 16) & 0x1F
+
+
+def imm(word: int) -> int:
+    return word & 0xFFFF
+
+
+def simm(word: int) -> int:
+    value = word & 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def hi_immediate(word: int) -> int:
+    if opcode(word) != OP_LUI:
+        raise Exception(f"expected lui for %hi, got {word:08X}")
+    return imm(word)
+
+
+def lo_immediate(word: int) -> int:
+    op = opcode(word)
+    if op not in LO16_OPCODES:
+        raise Exception(f"unexpected instruction for %lo: {word:08X}")
+    # ori zero-extends its immediate, everything else sign-extends.
+    return imm(word) if op == OP_ORI else simm(word)
+
+
+def hi_lo_address(hi_word: int, lo_word: int) -> int:
+    return ((hi_immediate(hi_word) << 16) + lo_immediate(lo_word)) & 0xFFFFFFFF
+
+
+def resolve_hi_lo(
+    words: Sequence[int], hi_indices: Sequence[int], lo_indices: Sequence[int]
+) -> List[int]:
+    """hi_lo_address for many (hi, lo) word index pairs into words at once."""
+    if np is None:
+        return [
+            hi_lo_address(words[hi], words[lo])
+            for hi, lo in zip(hi_indices, lo_indices)
+        ]
+
+    words = np.asarray(words).astype(np.int64)
+    hi_words = words[np.asarray(hi_indices, dtype=np.intp)]
+    lo_words = words[np.asarray(lo_indices, dtype=np.intp)]
+
+    bad = (hi_words >> 26) != OP_LUI
+    bad |= ~np.isin(lo_words >> 26, list(LO16_OPCODES))
+    if bad.any():
+        i = int(np.argmax(bad))
+        raise Exception(
+            f"not a %hi/%lo pair: {int(hi_words[i]):08X} {int(lo_words[i]):08X}"
+        )
+
+    lo_immediates = lo_words & 0xFFFF
+    sign_extend = (lo_words >> 26) != OP_ORI
+    lo_immediates -= ((lo_immediates & 0x8000) << 1) * sign_extend
+    return (((hi_words & 0xFFFF) << 16) + lo_immediates & 0xFFFFFFFF).tolist()
+
+
+GPR_NAMES = [
+    *("zero", "at", "v0", "v1", "a0", "a1", "a2", "a3"),
+    *("t0", "t1", "t2", "t3", "t4", "t5", "t6", "t7"),
+    *("s0", "s1", "s2", "s3", "s4", "s5", "s6", "s7"),
+    *("t8", "t9", "k0", "k1", "gp", "sp", "fp", "ra"),
+]
+
+JR_RA = 0x03E00008
+
+# SPECIAL funct -> (mnemonic, operand layout)
+SPECIAL_OPS: Dict[int, Tuple[str, str]] = {
+    0x00: ("sll", "dts"),
+    0x02: ("srl", "dts"),
+    0x03: ("sra", "dts"),
+    0x04: ("sllv", "dtr"),
+    0x06: ("srlv", "dtr"),
+    0x07: ("srav", "dtr"),
+    0x08: ("jr", "r"),
+    0x0F: ("sync", ""),
+    0x10: ("mfhi", "d"),
+    0x11: ("mthi", "r"),
+    0x12: ("mflo", "d"),
+    0x13: ("mtlo", "r"),
+    0x14: ("dsllv", "dtr"),
+    0x16: ("dsrlv", "dtr"),
+    0x17: ("dsrav", "dtr"),
+    0x18: ("mult", "rt"),
+    0x19: ("multu", "rt"),
+    0x1A: ("div", "0rt"),
+    0x1B: ("divu", "0rt"),
+    0x1C: ("dmult", "rt"),
+    0x1D: ("dmultu", "rt"),
+    0x1E: ("ddiv", "0rt"),
+    0x1F: ("ddivu", "0rt"),
+    0x20: ("add", "drt"),
+    0x21: ("addu", "drt"),
+    0x22: ("sub", "drt"),
+    0x23: ("subu", "drt"),
+    0x24: ("and", "drt"),
+    0x25: ("or", "drt"),
+    0x26: ("xor", "drt"),
+    0x27: ("nor", "drt"),
+    0x2A: ("slt", "drt"),
+    0x2B: ("sltu", "drt"),
+    0x2C: ("dadd", "drt"),
+    0x2D: ("daddu", "drt"),
+    0x2E: ("dsub", "drt"),
+    0x2F: ("dsubu", "drt"),
+    0x38: ("dsll", "dts"),
+    0x3A: ("dsrl", "dts"),
+    0x3B: ("dsra", "dts"),
+    0x3C: ("dsll32", "dts"),
+    0x3E: ("dsrl32", "dts"),
+    0x3F: ("dsra32", "dts"),
+}
+
+REGIMM_OPS = {0x00: "bltz", 0x01: "bgez", 0x02: "bltzl", 0x03: "bgezl"}
+REGIMM_OPS.update({0x10: "bltzal", 0x11: "bgezal"})
+
+BRANCH_OPS = {0x04: "beq", 0x05: "bne", 0x14: "beql", 0x15: "bnel"}
+BRANCH_Z_OPS = {0x06: "blez", 0x07: "bgtz", 0x16: "blezl", 0x17: "bgtzl"}
+
+SIGNED_IMM_OPS = {0x08: "addi", 0x09: "addiu", 0x0A: "slti", 0x0B: "sltiu"}
+SIGNED_IMM_OPS.update({0x18: "daddi", 0x19: "daddiu"})
+UNSIGNED_IMM_OPS = {0x0C: "andi", 0x0D: "ori", 0x0E: "xori"}
+
+LOAD_STORE_OPS = {
+    0x1A: "ldl",
+    0x1B: "ldr",
+    0x20: "lb",
+    0x21: "lh",
+    0x22: "lwl",
+    0x23: "lw",
+    0x24: "lbu",
+    0x25: "lhu",
+    0x26: "lwr",
+    0x27: "lwu",
+    0x28: "sb",
+    0x29: "sh",
+    0x2A: "swl",
+    0x2B: "sw",
+    0x2C: "sdl",
+    0x2D: "sdr",
+    0x2E: "swr",
+    0x30: "ll",
+    0x34: "lld",
+    0x37: "ld",
+    0x38: "sc",
+    0x3C: "scd",
+    0x3F: "sd",
+}
+FPU_LOAD_STORE_OPS = {0x31: "lwc1", 0x35: "ldc1", 0x39: "swc1", 0x3D: "sdc1"}
+
+OP_COP1 = 0x11
+COP1_MOVES = {0x00: "mfc1", 0x01: "dmfc1", 0x02: "cfc1"}
+COP1_MOVES.update({0x04: "mtc1", 0x05: "dmtc1", 0x06: "ctc1"})
+COP1_BRANCHES = ["bc1f", "bc1t", "bc1fl", "bc1tl"]
+COP1_FORMATS = {0x10: "s", 0x11: "d", 0x14: "w", 0x15: "l"}
+# COP1 arithmetic funct -> (mnemonic, takes ft)
+COP1_OPS: Dict[int, Tuple[str, bool]] = {
+    0x00: ("add", True),
+    0x01: ("sub", True),
+    0x02: ("mul", True),
+    0x03: ("div", True),
+    0x04: ("sqrt", False),
+    0x05: ("abs", False),
+    0x06: ("mov", False),
+    0x07: ("neg", False),
+    0x08: ("round.l", False),
+    0x09: ("trunc.l", False),
+    0x0A: ("ceil.l", False),
+    0x0B: ("floor.l", False),
+    0x0C: ("round.w", False),
+    0x0D: ("trunc.w", False),
+    0x0E: ("ceil.w", False),
+    0x0F: ("floor.w", False),
+    0x20: ("cvt.s", False),
+    0x21: ("cvt.d", False),
+    0x24: ("cvt.w", False),
+    0x25: ("cvt.l", False),
+}
+COP1_CONDITIONS = [
+    *("f", "un", "eq", "ueq", "olt", "ult", "ole", "ule"),
+    *("sf", "ngle", "seq", "ngl", "lt", "nge", "le", "ngt"),
+]
+
+
+def _gpr(n: int) -> str:
+    return "$" + GPR_NAMES[n]
+
+
+def _number(value: int) -> str:
+    if -10 < value < 10:
+        return str(value)
+    return f"-0x{-value:x}" if value < 0 else f"0x{value:x}"
+
+
+def branch_target(word: int, vram: int) -> Optional[int]:
+    """Where a conditional branch at vram goes, or None if it isn't one."""
+    op = opcode(word)
+    is_branch = (
+        op in BRANCH_OPS
+        or op in BRANCH_Z_OPS
+        or (op == 0x01 and rt(word) in REGIMM_OPS)
+        or (op == OP_COP1 and rs(word) == 0x08)
+    )
+    if not is_branch:
+        return None
+    return (vram + 4 + (simm(word) << 2)) & 0xFFFFFFFF
+
+
+def decode(word: int, vram: int, labels: Set[int]) -> Tuple[str, str]:
+    """(mnemonic, operands) in GNU as syntax; (".word", hex) if unrecognized.
+
+    Branches are only spelled with a label when their target is in labels,
+    so the output always reassembles to the same bytes.
+    """
+    op = opcode(word)
+    s, t = rs(word), rt(word)
+    d, sa = (word >> 11) & 0x1F, (word >> 6) & 0x1F
+    unknown = (".word", f"0x{word:08X}")
+
+    if word == 0:
+        return "nop", ""
+
+    target = branch_target(word, vram)
+    if target is not None:
+        if target not in labels:
+            return unknown
+        label = f".L{target:08X}"
+        if op in BRANCH_OPS:
+            return BRANCH_OPS[op], f"{_gpr(s)}, {_gpr(t)}, {label}"
+        if op in BRANCH_Z_OPS and t == 0:
+            return BRANCH_Z_OPS[op], f"{_gpr(s)}, {label}"
+        if op == 0x01:
+            return REGIMM_OPS[t], f"{_gpr(s)}, {label}"
+        if op == OP_COP1 and t < 4:
+            return COP1_BRANCHES[t], label
+        return unknown
+
+    if op == 0x00:
+        funct = word & 0x3F
+        if funct == 0x09:
+            if t or sa:
+                return unknown
+            return "jalr", _gpr(s) if d == 31 else f"{_gpr(d)}, {_gpr(s)}"
+        if funct == 0x0D:
+            code1, code2 = (word >> 16) & 0x3FF, (word >> 6) & 0x3FF
+            if code2:
+                return "break", f"{code1}, {code2}"
+            return "break", str(code1) if code1 else ""
+        if funct not in SPECIAL_OPS:
+            return unknown
+        mnemonic, layout = SPECIAL_OPS[funct]
+        # Fields the layout doesn't print must be zero to reassemble the same.
+        unused = [(s, "r"), (t, "t"), (d, "d"), (sa, "s")]
+        if any(value and c not in layout for value, c in unused):
+            return unknown
+        fields = {"d": _gpr(d), "t": _gpr(t), "r": _gpr(s)}
+        fields.update({"s": str(sa), "0": "$zero"})
+        return mnemonic, ", ".join(fields[c] for c in layout)
+
+    if op in (0x02, 0x03):
+        target = ((vram + 4) & 0xF0000000) | ((word & 0x3FFFFFF) << 2)
+        if op == 0x02 and target in labels:
+            return "j", f".L{target:08X}"
+        return ("j" if op == 0x02 else "jal"), f"func_{target:08X}"
+
+    if op in SIGNED_IMM_OPS:
+        return SIGNED_IMM_OPS[op], f"{_gpr(t)}, {_gpr(s)}, {_number(simm(word))}"
+    if op in UNSIGNED_IMM_OPS:
+        return UNSIGNED_IMM_OPS[op], f"{_gpr(t)}, {_gpr(s)}, {_number(imm(word))}"
+    if op == OP_LUI and s == 0:
+        return "lui", f"{_gpr(t)}, {_number(imm(word))}"
+    if op in LOAD_STORE_OPS:
+        return LOAD_STORE_OPS[op], f"{_gpr(t)}, {_number(simm(word))}({_gpr(s)})"
+    if op in FPU_LOAD_STORE_OPS:
+        return FPU_LOAD_STORE_OPS[op], f"$f{t}, {_number(simm(word))}({_gpr(s)})"
+
+    if op == OP_COP1:
+        if s in COP1_MOVES:
+            if word & 0x7FF:
+                return unknown
+            fs = f"${d}" if s in (0x02, 0x06) else f"$f{d}"
+            return COP1_MOVES[s], f"{_gpr(t)}, {fs}"
+        if s not in COP1_FORMATS:
+            return unknown
+        fmt, funct = COP1_FORMATS[s], word & 0x3F
+        if funct >= 0x30 and fmt in "sd" and sa == 0:
+            return f"c.{COP1_CONDITIONS[funct & 0xF]}.{fmt}", f"$f{d}, $f{t}"
+        if funct not in COP1_OPS:
+            return unknown
+        mnemonic, takes_ft = COP1_OPS[funct]
+        # Integer formats only convert, and nothing converts to its own format.
+        if fmt in "wl" and funct not in (0x20, 0x21) or mnemonic == f"cvt.{fmt}":
+            return unknown
+        if t and not takes_ft:
+            return unknown
+        operands = f"$f{sa}, $f{d}" + (f", $f{t}" if takes_ft else "")
+        return f"{mnemonic}.{fmt}", operands
+
+    return unknown
+
+
+def as_ints(words: Sequence[int]) -> List[int]:
+    """words as Python ints; Rom.words gives NumPy scalars, which overflow."""
+    if hasattr(words, "tolist"):
+        return words.tolist()
+    return [int(word) for word in words]
+
+
+def function_size(words: Sequence[int], vram: int) -> int:
+    """Bytes up to the delay slot of the jr $ra no branch can jump past.
+
+    >>> import warnings
+    >>> words = [0x1000FFFF, 0, JR_RA, 0]  # a backward branch, then return
+    >>> words = words if np is None else np.array(words, dtype=">u4")
+    >>> with warnings.catch_warnings():
+    ...     warnings.simplefilter("error")
+    ...     function_size(words, 0x80246000), len(disassemble(words, 0x80246000, 0))
+    (16, 5)
+    """
+    words = as_ints(words)
+    furthest = vram
+    for i, word in enumerate(words):
+        target = branch_target(word, vram + i * 4)
+        if target is not None:
+            furthest = max(furthest, target)
+        if word == JR_RA and vram + (i + 2) * 4 > furthest:
+            return min(i + 2, len(words)) * 4
+    return len(words) * 4
+
+
+def disassemble(words: Sequence[int], vram: int, rom_offset: int) -> List[str]:
+    """mipsdisasm-style lines for words, with .L labels at branch targets."""
+    words = as_ints(words)
+    end = vram + len(words) * 4
+    labels = set()
+    for i, word in enumerate(words):
+        target = branch_target(word, vram + i * 4)
+        if opcode(word) == 0x02:
+            target = ((vram + i * 4 + 4) & 0xF0000000) | ((word & 0x3FFFFFF) << 2)
+        if target is not None and vram <= target < end and target % 4 == 0:
+            labels.add(target)
+
+    lines = []
+    for i, word in enumerate(words):
+        addr = vram + i * 4
+        if addr in labels:
+            lines.append(f".L{addr:08X}:")
+        mnemonic, operands = decode(int(word), addr, labels)
+        lines.append(
+            f"/* {rom_offset + i * 4:06X} {addr:08X} {int(word):08X} */  "
+            f"{mnemonic:<5} {operands}".rstrip()
+        )
+    return lines
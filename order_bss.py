@@ -1,236 +1,193 @@
-#!/usr/bin/env python3.8
-"""Forked from order_data.py."""
-import argparse
-import os
-import subprocess
-from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-
-
-def get_baserom_asm_line(sm64_source: str, sm64tools: str, offset: str) -> str:
-    return get_asm_line(
-        sm64_source, sm64tools, offset, str(Path(sm64_source) / "baserom.eu.z64")
-    )
-
-
-def get_builtrom_asm_line(sm64_source: str, sm64tools: str, offset: str) -> str:
-    return get_asm_line(
-        sm64_source,
-        sm64tools,
-        offset,
-        str(Path(sm64_source) / "build" / "eu" / "sm64.eu.z64"),
-    )
-
-
-def get_asm_line(sm64_source: str, sm64tools: str, offset: str, rom: str) -> str:
-    output = (
-        subprocess.run(
-            [
-                str(Path(sm64tools) / "mipsdisasm"),
-                "-p",
-                rom,
-                f"0x80200000:{offset}+0x4",
-            ],
-            stdout=subprocess.PIPE,
-        )
-        .stdout.decode("utf-8")
-        .strip()
-    )
-    return output.split("\n")[-1]
-
-
-def get_real_ram_addrs(
-    sm64_source: str, sm64tools: str, symbol: str, o_file: str, file_rom_start: str
-) -> Optional[Tuple[str, str]]:
-    objdump_output = (
-        subprocess.run(
-            ["mips-linux-gnu-objdump", "-rd", str(o_file)], stdout=subprocess.PIPE
-        )
-        .stdout.decode("utf-8")
-        .split("\n")
-    )
-
-    hi_offset = ""
-    lo_offset = ""
-    for line in objdump_output:
-        if symbol in line:
-            if "R_MIPS_HI16" in line:
-                hi_offset = line.split(":")[0].strip()
-            elif "R_MIPS_LO16" in line:
-                lo_offset = line.split(":")[0].strip()
-            else:
-                raise Exception(f"unsure why {symbol} in line: {line}")
-    if not hi_offset and not lo_offset:
-        # print(f"{symbol} is gone")
-        return None
-    elif not hi_offset or not lo_offset:
-        raise Exception("wasn't able to find both hi and lo offsets")
-
-    baserom_builtrom_ram_addrs: Tuple[str, str] = ("", "")
-    for rom_func in (get_baserom_asm_line, get_builtrom_asm_line):
-        hi_asm_line = hex(int(file_rom_start, 16) + int(hi_offset, 16))
-        real_hi_offset = (
-            "0x"
-            + rom_func(sm64_source, sm64tools, hi_asm_line).split("0x")[-1].split()[0]
-        )
-
-        lo_asm_line = hex(int(file_rom_start, 16) + int(lo_offset, 16))
-        thing = rom_func(sm64_source, sm64tools, lo_asm_line).split("0x")
-        negate = False
-        if thing[0][-1] == "-":
-            negate = True
-        real_lo_offset = (
-            ("-" if negate else "") + "0x" + thing[-1].split()[0].split("(")[0]
-        )
-
-        real_ram_addr = hex(int(real_hi_offset + "0000", 16) + int(real_lo_offset, 16))
-
-        if rom_func == get_baserom_asm_line:
-            baserom_builtrom_ram_addrs = (real_ram_addr, baserom_builtrom_ram_addrs[1])
-        else:
-            baserom_builtrom_ram_addrs = (baserom_builtrom_ram_addrs[0], real_ram_addr)
-
-    return baserom_builtrom_ram_addrs
-
-
-def get_symbols(o_file: str, segment: str) -> List[str]:
-    symbol_table = (
-        subprocess.run(["mips-linux-gnu-objdump", "-t", o_file], stdout=subprocess.PIPE)
-        .stdout.decode("utf-8")
-        .split("\n")
-    )
-    return [
-        line.split()[-1]
-        for line in symbol_table
-        if segment in line and not line.endswith(segment)
-    ]
-
-
-def get_o_files_and_offsets(sm64_source: str) -> List[Tuple[Path, str]]:
-    o_files_and_offsets = []
-
-    sm64_path = Path(sm64_source)
-    map_file = sm64_path / "build" / "eu" / "sm64.eu.map"
-    lines = map_file.read_text().split("\n")
-
-    ram_to_rom = int("0x80240800", 16)
-    # ram_to_rom = int("0x802B07F0", 16)
-    # ram_to_rom = int("0x802A88B0", 16)
-    # ram_to_rom = int("0x7FF6EF60", 16)
-    # ram_to_rom = int("0x7FF6EF60", 16)  # goddard
-
-    seen_main = False
-    for idx, line in enumerate(lines):
-        line = line.strip()
-
-        if ".main" in line:
-        # if ".engine" in line:
-        # if ".goddard" in line:
-            # if ".buffers.noload" in line:
-            seen_main = True
-        elif not seen_main:
-            continue
-
-        if ".engine" in line:
-        # if ".menu" in line:
-        # if ".buffers" in line:
-        # if ".intro_segment_7" in line:
-            # print("encountered engine - done parsing map")
-            # print("encountered menu - done parsing map")
-            # print("encountered buffers - done parsing map")
-            print("done parsing map")
-            break
-
-        if "(.text)" not in line or "*.o" in line:
-            continue
-
-        line = line[: -len("(.text)")]
-
-        filepath: Optional[Path] = None
-        if "libultra.a" not in line and "libgoddard.a" not in line:
-            filepath = sm64_path / line
-        elif (maybe := sm64_path / line.replace("ultra.a:", "/src/")).is_file():
-            filepath = maybe
-        elif (maybe := sm64_path / line.replace("ultra.a:", "/asm/")).is_file():
-            filepath = maybe
-        elif (
-            maybe := sm64_path / line.replace("libgoddard.a:", "src/goddard/")
-        ).is_file():
-            filepath = maybe
-        else:
-            print(f"can't figure out how to make this a real .o file: {line}")
-            continue
-
-        if not (offset_line := lines[idx + 1].strip()).startswith(".text"):
-            offset_line = lines[idx + 2].strip()
-
-        offset = hex(int(offset_line.split()[1], 16) - ram_to_rom)
-
-        o_files_and_offsets.append((filepath, offset))
-
-    return o_files_and_offsets
-
-
-def print_symbol_position_diff(
-    symbol: str, args, sm64tools, o_file, file_rom_start
-) -> Optional[Tuple[str, str, str]]:
-    ram_addrs = get_real_ram_addrs(
-        args.sm64_source, sm64tools, symbol, o_file, file_rom_start
-    )
-    if ram_addrs:
-        baserom, builtrom = ram_addrs
-        diff = hex(int(baserom, 16) - int(builtrom, 16))
-        return (baserom, builtrom, diff)
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("sm64_source", help="Path to sm64_source")
-    parser.add_argument("master_o_file", help="Path to o file to order bss in")
-    args = parser.parse_args()
-
-    o_files_and_offsets = get_o_files_and_offsets(args.sm64_source)
-
-    sm64tools = os.environ.get("SM64_TOOLS")
-    if not sm64tools:
-        raise Exception("define SM64_TOOLS as an env var")
-
-    symbol_positions: Dict[str, Tuple[str, str, str]] = {}
-    bss_symbols = get_symbols(args.master_o_file, segment=".bss")
-    for o_file, file_rom_start in o_files_and_offsets:
-        if o_file.name == Path(args.master_o_file).name:
-            for symbol in bss_symbols:
-                pos = print_symbol_position_diff(
-                    symbol, args, sm64tools, o_file, file_rom_start
-                )
-                if not pos:
-                    continue
-                if symbol in symbol_positions:
-                    if symbol_positions[symbol] != pos:
-                        print(
-                            f"inconsistent position info for {symbol}: "
-                            f"{symbol_positions[symbol]} vs {pos} in {o_file.name}"
-                        )
-                else:
-                    symbol_positions[symbol] = pos
-        else:
-            for symbol in get_symbols(o_file, segment="*UND*"):
-                if symbol in bss_symbols:
-                    pos = print_symbol_position_diff(
-                        symbol, args, sm64tools, o_file, file_rom_start
-                    )
-                    if not pos:
-                        continue
-                    if symbol in symbol_positions:
-                        if symbol_positions[symbol] != pos:
-                            print(
-                                f"inconsistent position info for {symbol}: "
-                                f"{symbol_positions[symbol]} vs {pos} in {o_file.name}"
-                            )
-                    else:
-                        symbol_positions[symbol] = pos
-    for symbol, (baserom, builtrom, diff) in sorted(
-        symbol_positions.items(), key=lambda kv: int(kv[1][0], 16)
-    ):
-        print(f"{symbol}: {baserom=!s}, {builtrom=!s}... {diff=!s}")
-
+#!/usr/bin/env python3.8
+"""Forked from order_data.py."""
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import disasm
+import elf
+import linker_map
+import mips
+import symbol_db
+from result_store import ResultStore, object_key
+from rom import Rom
+
+
+def get_rom_words(
+    rom: Rom, start: int, end: int, use_mipsdisasm: bool = False
+) -> Sequence[int]:
+    if use_mipsdisasm:
+        return disasm.get_disassembler().get_words(str(rom.path), start, end - start)
+    return rom.words(start, end)
+
+
+def get_word_range(
+    o_file: str, symbols: List[str], file_rom_start: str
+) -> Optional[Tuple[int, int]]:
+    """The ROM range holding every %hi/%lo o_file has for symbols, if any."""
+    pairs = elf.get_hi_lo_pairs(str(o_file))
+    offsets = [
+        offset for symbol in symbols if symbol in pairs for offset in pairs[symbol][-1]
+    ]
+    if not offsets:
+        return None
+    start = int(file_rom_start, 16)
+    return start, start + 4 * (max(offsets) // 4 + 1)
+
+
+def prefetch_words(sm64_source: str, ranges: List[Tuple[int, int]]):
+    """Have mipsdisasm decode every range of both ROMs in one batch.
+
+    Later get_rom_words calls for these ranges are answered from its cache.
+    """
+    disassembler = disasm.get_disassembler()
+    futures = [
+        disassembler.submit(str(rom.path), start, end - start)
+        for rom in [Rom.baserom(sm64_source), Rom.builtrom(sm64_source)]
+        for start, end in ranges
+    ]
+    for future in futures:
+        future.result()
+
+
+def get_real_ram_addrs(
+    sm64_source: str,
+    symbols: List[str],
+    o_file: str,
+    file_rom_start: str,
+    use_mipsdisasm: bool = False,
+) -> Dict[str, Tuple[str, str]]:
+    """Baserom and built ROM addresses of every symbol o_file has a %hi/%lo for.
+
+    All pairs are resolved together from the object's .text words in each ROM.
+    """
+    word_range = get_word_range(o_file, symbols, file_rom_start)
+    if word_range is None:
+        return {}
+    start, end = word_range
+    pairs = elf.get_hi_lo_pairs(str(o_file))
+    found = [symbol for symbol in symbols if symbol in pairs]
+    hi_indices = [pairs[symbol][-1][0] // 4 for symbol in found]
+    lo_indices = [pairs[symbol][-1][1] // 4 for symbol in found]
+
+    baserom_words = get_rom_words(Rom.baserom(sm64_source), start, end, use_mipsdisasm)
+    builtrom_words = get_rom_words(
+        Rom.builtrom(sm64_source), start, end, use_mipsdisasm
+    )
+    baserom_addrs = mips.resolve_hi_lo(baserom_words, hi_indices, lo_indices)
+    builtrom_addrs = mips.resolve_hi_lo(builtrom_words, hi_indices, lo_indices)
+    return {
+        symbol: (hex(baserom), hex(builtrom))
+        for symbol, baserom, builtrom in zip(found, baserom_addrs, builtrom_addrs)
+    }
+
+
+def get_symbols(sm64_source: str, o_file: str, segment: str) -> List[str]:
+    """Symbols o_file defines in a section, or references if segment is *UND*."""
+    return symbol_db.open_db(sm64_source).object_symbols(o_file, segment)
+
+
+def get_symbol_position_diffs(
+    symbols: List[str], args, o_file, file_rom_start
+) -> Dict[str, Tuple[str, str, str]]:
+    return {
+        symbol: (baserom, builtrom, hex(int(baserom, 16) - int(builtrom, 16)))
+        for symbol, (baserom, builtrom) in get_real_ram_addrs(
+            args.sm64_source, symbols, o_file, file_rom_start, args.mipsdisasm
+        ).items()
+    }
+
+
+def get_referenced_bss(args, o_file: Path, bss_symbols: List[str]) -> List[str]:
+    """The master .o's bss symbols that o_file references."""
+    if o_file.name == Path(args.master_o_file).name:
+        return bss_symbols
+    return [
+        symbol
+        for symbol in get_symbols(args.sm64_source, o_file, segment="*UND*")
+        if symbol in bss_symbols
+    ]
+
+
+def get_object_positions(
+    args, o_file: Path, file_rom_start: str, symbols: List[str]
+) -> List[Tuple[str, Tuple[str, str, str]]]:
+    """Position info for symbols (from get_referenced_bss) as used by o_file.
+
+    symbols is resolved in the main process; workers don't open the symbol
+    database.
+    """
+    diffs = get_symbol_position_diffs(symbols, args, o_file, file_rom_start)
+    return [(symbol, diffs[symbol]) for symbol in symbols if symbol in diffs]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sm64_source", help="Path to sm64_source")
+    parser.add_argument("master_o_file", help="Path to o file to order bss in")
+    parser.add_argument(
+        "--segment", default=".main", help="Linker map segment to look through"
+    )
+    parser.add_argument(
+        "--mipsdisasm",
+        action="store_true",
+        help="Read instructions through $SM64_TOOLS/mipsdisasm instead of the ROM",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="Object files to process at once"
+    )
+    args = parser.parse_args()
+
+    symbol_db.open_db(args.sm64_source).refresh()
+    o_files_and_offsets = linker_map.get_o_files_and_offsets(
+        args.sm64_source, args.segment
+    )
+
+    symbol_positions: Dict[str, Tuple[str, str, str]] = {}
+    bss_symbols = get_symbols(args.sm64_source, args.master_o_file, segment=".bss")
+    store = ResultStore.for_source(args.sm64_source, "order_bss")
+    master_key = "\n".join([Path(args.master_o_file).name] + bss_symbols)
+    referenced = [
+        get_referenced_bss(args, o_file, bss_symbols)
+        for o_file, _ in o_files_and_offsets
+    ]
+    if args.mipsdisasm:
+        word_ranges = (
+            get_word_range(o_file, symbols, file_rom_start)
+            for (o_file, file_rom_start), symbols in zip(
+                o_files_and_offsets, referenced
+            )
+        )
+        prefetch_words(
+            args.sm64_source, [word_range for word_range in word_ranges if word_range]
+        )
+    all_positions = store.map(
+        get_object_positions,
+        [
+            (
+                o_file,
+                object_key(args.sm64_source, o_file, file_rom_start, master_key),
+                (args, o_file, file_rom_start, symbols),
+            )
+            for (o_file, file_rom_start), symbols in zip(
+                o_files_and_offsets, referenced
+            )
+        ],
+        args.jobs,
+        # Workers share the prefetched mipsdisasm cache as threads.
+        threads=args.mipsdisasm,
+    )
+    for (o_file, _), positions in zip(o_files_and_offsets, all_positions):
+        for symbol, pos in positions:
+            if symbol in symbol_positions:
+                if symbol_positions[symbol] != pos:
+                    print(
+                        f"inconsistent position info for {symbol}: "
+                        f"{symbol_positions[symbol]} vs {pos} in {o_file.name}"
+                    )
+            else:
+                symbol_positions[symbol] = pos
+    for symbol, (baserom, builtrom, diff) in sorted(
+        symbol_positions.items(), key=lambda kv: int(kv[1][0], 16)
+    ):
+        print(f"{symbol}: {baserom=!s}, {builtrom=!s}... {diff=!s}")
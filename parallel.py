@@ -0,0 +1,29 @@
+"""Fan independent per-object work out over a process or thread pool."""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+def ordered_map(
+    func: Callable[..., T],
+    arg_tuples: Iterable[Sequence],
+    jobs: int = 1,
+    threads: bool = False,
+) -> Iterator[T]:
+    """Yield func(*args) for each args in order, running up to jobs at once.
+
+    Results stream back as soon as everything before them has finished, so
+    callers can merge them in input order and stay deterministic. Work that
+    mostly waits on a subprocess can use threads instead of processes.
+    """
+    if jobs <= 1:
+        for args in arg_tuples:
+            yield func(*args)
+        return
+
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    with executor(max_workers=jobs) as pool:
+        futures = [pool.submit(func, *args) for args in arg_tuples]
+        for future in futures:
+            yield future.result()
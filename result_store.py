@@ -0,0 +1,90 @@
+"""Persistent per-object results so reruns only redo objects that changed.
+
+Results live in an SQLite file under build/ and are keyed by a digest of the
+object file plus the baserom and built ROM bytes its .text occupies.
+"""
+import hashlib
+import pickle
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Callable, Iterator, List, Sequence, Tuple, TypeVar
+
+import cache
+import elf
+import parallel
+from rom import Rom
+
+T = TypeVar("T")
+
+
+def object_key(
+    sm64_source: str, o_file: Path, file_rom_start: str, extra: str = ""
+) -> str:
+    """Digest of everything a per-object result is derived from."""
+    text = elf.get_elf(str(o_file)).section(".text")
+    text_size = text.size if text is not None else 0
+    start = int(file_rom_start, 16)
+
+    digest = hashlib.sha1()
+    digest.update(cache.file_hash(o_file).encode("utf-8"))
+    digest.update(file_rom_start.encode("utf-8"))
+    for rom in (Rom.baserom(sm64_source), Rom.builtrom(sm64_source)):
+        digest.update(rom.bytes_at(start, text_size))
+    digest.update(extra.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultStore:
+    def __init__(self, db_path: Path, table: str):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.connection = sqlite3.connect(str(db_path))
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(o_file TEXT PRIMARY KEY, key TEXT NOT NULL, result BLOB NOT NULL)"
+        )
+
+    @classmethod
+    def for_source(
+        cls, sm64_source: str, table: str, version: str = "eu"
+    ) -> "ResultStore":
+        return cls(Path(sm64_source) / "build" / version / "helper_results.db", table)
+
+    def get(self, o_file: Path, key: str):
+        row = self.connection.execute(
+            f"SELECT result FROM {self.table} WHERE o_file = ? AND key = ?",
+            (str(o_file), key),
+        ).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, o_file: Path, key: str, result) -> None:
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+            (str(o_file), key, pickle.dumps(result)),
+        )
+
+    def map(
+        self,
+        func: Callable[..., T],
+        entries: List[Tuple[Path, str, Sequence]],
+        jobs: int = 1,
+        threads: bool = False,
+    ) -> Iterator[T]:
+        """parallel.ordered_map over (o_file, key, args), reusing stored results."""
+        cached = [self.get(o_file, key) for o_file, key, _ in entries]
+        missing = [i for i, result in enumerate(cached) if result is None]
+        print(
+            f"{len(entries) - len(missing)}/{len(entries)} objects unchanged",
+            file=sys.stderr,
+        )
+
+        computed = parallel.ordered_map(
+            func, [entries[i][2] for i in missing], jobs, threads
+        )
+        for i, (o_file, key, _) in enumerate(entries):
+            if cached[i] is None:
+                cached[i] = next(computed)
+                self.put(o_file, key, cached[i])
+                self.connection.commit()
+            yield cached[i]
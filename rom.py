@@ -0,0 +1,68 @@
+"""Memory-mapped ROM images shared by the helper scripts.
+
+Each ROM file is mapped once per process; slices are zero-copy memoryviews and
+word views are big-endian uint32 arrays (NumPy when available, array otherwise).
+"""
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Rom:
+    _open_roms: Dict[str, "Rom"] = {}
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, "rb") as rom_file:
+            self._mmap = mmap.mmap(rom_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self._mmap)
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "Rom":
+        key = str(Path(path).resolve())
+        if key not in cls._open_roms:
+            cls._open_roms[key] = cls(path)
+        return cls._open_roms[key]
+
+    @classmethod
+    def baserom(cls, sm64_source: str, version: str = "eu") -> "Rom":
+        return cls.open(Path(sm64_source) / f"baserom.{version}.z64")
+
+    @classmethod
+    def builtrom(cls, sm64_source: str, version: str = "eu") -> "Rom":
+        return cls.open(Path(sm64_source) / "build" / version / f"sm64.{version}.z64")
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key: slice) -> memoryview:
+        return self.data[key]
+
+    def bytes_at(self, offset: int, size: int) -> memoryview:
+        return self.data[offset : offset + size]
+
+    def find(self, sub: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        return self._mmap.find(sub, start, len(self) if end is None else end)
+
+    def word(self, offset: int) -> int:
+        return struct.unpack_from(">I", self._mmap, offset)[0]
+
+    def words(self, start: int, end: int) -> Sequence[int]:
+        """Big-endian 32-bit words in [start, end); a zero-copy view under NumPy."""
+        if np is not None:
+            return np.frombuffer(
+                self._mmap, dtype=">u4", count=(end - start) // 4, offset=start
+            )
+        words = array("I")
+        words.frombytes(self.data[start:end])
+        if sys.byteorder == "little":
+            words.byteswap()
+        return words
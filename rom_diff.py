@@ -0,0 +1,158 @@
+"""Every difference between the baserom and the built ROM, located in the map.
+
+Both ROMs are compared chunk by chunk as big-endian word arrays; only chunks
+that differ are scanned word by word. Each differing range is then split at
+symbol boundaries and attributed to its function, object and C file.
+"""
+import re
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import linker_map
+from rom import Rom
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 0x10000
+
+
+class DiffLocation(NamedTuple):
+    start: int
+    end: int
+    symbol: Optional[str]
+    symbol_rom: Optional[int]
+    object_name: Optional[str]
+    c_file: Optional[str]
+
+
+def _differing_words(base: Rom, built: Rom, start: int, end: int) -> Iterator[int]:
+    if np is not None:
+        differs = base.words(start, end) != built.words(start, end)
+        for index in np.flatnonzero(differs).tolist():
+            yield start + index * 4
+        return
+    base_words, built_words = base.words(start, end), built.words(start, end)
+    for index, (a, b) in enumerate(zip(base_words, built_words)):
+        if a != b:
+            yield start + index * 4
+
+
+def diff_ranges(
+    base: Rom, built: Rom, start: int = 0, end: Optional[int] = None
+) -> List[Tuple[int, int]]:
+    """[start, end) ROM ranges of consecutive differing words, in order.
+
+    Whatever one ROM has past the end of the other counts as one more range.
+    """
+    common_end = min(len(base), len(built))
+    if end is None:
+        end = max(len(base), len(built))
+    compare_end = min(end, common_end)
+    compare_end -= (compare_end - start) % 4
+
+    ranges: List[Tuple[int, int]] = []
+    for chunk_start in range(start, compare_end, CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHUNK_SIZE, compare_end)
+        if base[chunk_start:chunk_end] == built[chunk_start:chunk_end]:
+            continue
+        for offset in _differing_words(base, built, chunk_start, chunk_end):
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], offset + 4)
+            else:
+                ranges.append((offset, offset + 4))
+
+    if compare_end < end:
+        tail_start = max(start, compare_end)
+        if ranges and ranges[-1][1] == tail_start:
+            tail_start = ranges.pop()[0]
+        ranges.append((tail_start, end))
+    return ranges
+
+
+class SymbolIndex:
+    """The map's code sorted by ROM address, for bisecting into.
+
+    Only loaded .text input sections and their symbols are indexed, so a
+    difference is never blamed on data that merely shares its address.
+    """
+
+    def __init__(self, lmap: linker_map.LinkerMap, version: str = "eu"):
+        self.object_re = re.compile(rf"build/{version}/(.*)\.o$")
+        text_inputs = {
+            i
+            for i, input_section in enumerate(lmap.inputs)
+            if input_section.section.startswith(".text")
+            and input_section.rom is not None
+            and input_section.size > 0
+        }
+        self.inputs = sorted(
+            (lmap.inputs[i] for i in text_inputs),
+            key=lambda input_section: input_section.rom,
+        )
+        self.input_starts = [input_section.rom for input_section in self.inputs]
+        self.symbols = sorted(
+            (
+                symbol
+                for symbol in lmap.symbols
+                if symbol.input_index in text_inputs and symbol.rom is not None
+            ),
+            key=lambda symbol: symbol.rom,
+        )
+        self.starts = [symbol.rom for symbol in self.symbols]
+
+    def input_at(self, offset: int) -> Optional[linker_map.InputSection]:
+        pos = bisect_right(self.input_starts, offset) - 1
+        if pos < 0:
+            return None
+        input_section = self.inputs[pos]
+        return (
+            input_section
+            if offset < self.input_starts[pos] + input_section.size
+            else None
+        )
+
+    def locate(self, start: int, end: int) -> Iterator[DiffLocation]:
+        """[start, end) split at symbol and input section boundaries."""
+        while start < end:
+            input_section = self.input_at(start)
+            pos = bisect_right(self.starts, start)
+            boundary = self.starts[pos] if pos < len(self.starts) else end
+            symbol = self.symbols[pos - 1] if pos > 0 else None
+
+            if input_section is None:
+                symbol = None
+            else:
+                input_rom = input_section.rom or 0
+                boundary = min(boundary, input_rom + input_section.size)
+                if symbol is not None and (symbol.rom or 0) < input_rom:
+                    symbol = None
+
+            chunk_end = min(max(boundary, start + 1), end)
+            object_name = input_section.object_name if input_section else None
+            match = self.object_re.match(object_name or "")
+            yield DiffLocation(
+                start,
+                chunk_end,
+                symbol.name if symbol else None,
+                symbol.rom if symbol else None,
+                object_name,
+                match.group(1) + ".c" if match else None,
+            )
+            start = chunk_end
+
+
+def diff_roms(sm64_source: str, version: str = "eu") -> List[DiffLocation]:
+    """Every differing range between baserom and the current build, located."""
+    base = Rom.baserom(sm64_source, version)
+    # Not Rom.builtrom: that mapping is shared and goes stale across rebuilds.
+    built = Rom(Path(sm64_source) / "build" / version / f"sm64.{version}.z64")
+    index = SymbolIndex(linker_map.load_map(sm64_source, version), version)
+    return [
+        location
+        for start, end in diff_ranges(base, built)
+        for location in index.locate(start, end)
+    ]
@@ -0,0 +1,266 @@
+"""One on-disk symbol database shared by the helper scripts.
+
+Map symbols (name, RAM/ROM address, size, object), the symbol tables of the
+linked objects and the names declared in every header are kept in an SQLite
+file under build/. Each source is reindexed only when its mtime or size
+changes, so tools query it at startup instead of rescanning.
+"""
+import os
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Union
+
+import elf
+import header_index
+import linker_map
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS map_symbols (
+    name TEXT NOT NULL, ram INTEGER NOT NULL, rom INTEGER, size INTEGER NOT NULL,
+    section TEXT NOT NULL, object TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS map_symbols_name ON map_symbols (name);
+CREATE INDEX IF NOT EXISTS map_symbols_ram ON map_symbols (ram);
+CREATE INDEX IF NOT EXISTS map_symbols_rom ON map_symbols (rom);
+CREATE INDEX IF NOT EXISTS map_symbols_object ON map_symbols (object);
+CREATE TABLE IF NOT EXISTS object_symbols (
+    object TEXT NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL,
+    section TEXT NOT NULL, value INTEGER NOT NULL, size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS object_symbols_object ON object_symbols (object, section);
+CREATE INDEX IF NOT EXISTS object_symbols_name ON object_symbols (name);
+CREATE TABLE IF NOT EXISTS header_names (
+    name TEXT NOT NULL, kind TEXT NOT NULL, header TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS header_names_name ON header_names (name, kind);
+CREATE INDEX IF NOT EXISTS header_names_header ON header_names (header);
+"""
+
+# Bumped whenever what gets indexed changes, so stale rows are rebuilt.
+SCHEMA_VERSION = 2
+
+HEADER_ROOTS = ("src", "include")
+
+PathLike = Union[str, Path]
+
+
+class SymbolRow(NamedTuple):
+    name: str
+    ram: int
+    rom: Optional[int]
+    size: int
+    section: str
+    object: str
+
+
+class SymbolDatabase:
+    def __init__(self, db_path: Path, sm64_source: str, version: str = "eu"):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.sm64_source = Path(sm64_source)
+        self.version = version
+        self.connection = sqlite3.connect(str(db_path), timeout=60)
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            for (table,) in self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            ).fetchall():
+                self.connection.execute(f"DROP TABLE {table}")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def for_source(cls, sm64_source: str, version: str = "eu") -> "SymbolDatabase":
+        db_path = Path(sm64_source) / "build" / version / "symbols.db"
+        return cls(db_path, sm64_source, version)
+
+    def _changed(self, path: Path) -> bool:
+        stat = path.stat()
+        row = self.connection.execute(
+            "SELECT mtime_ns, size FROM sources WHERE path = ?", (str(path),)
+        ).fetchone()
+        return row != (stat.st_mtime_ns, stat.st_size)
+
+    def _mark(self, path: Path) -> None:
+        stat = path.stat()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+            (str(path), stat.st_mtime_ns, stat.st_size),
+        )
+
+    def refresh(self, linked: bool = True, headers: bool = False) -> None:
+        """Reindex whatever changed among the map and its objects, and headers."""
+        map_path = linker_map.get_map_path(str(self.sm64_source), self.version)
+        if linked and map_path.exists():
+            lmap = linker_map.load_map(str(self.sm64_source), self.version)
+            if self._changed(map_path):
+                self._index_map(lmap)
+                self._mark(map_path)
+            o_files = {
+                linker_map.object_path(str(self.sm64_source), inp.object_name)
+                for inp in lmap.inputs
+                if inp.object_name
+            }
+            for o_file in sorted(o for o in o_files if o is not None and o.is_file()):
+                self._index_object(o_file)
+        if headers:
+            self._index_headers()
+        self.connection.commit()
+
+    def _index_map(self, lmap: linker_map.LinkerMap) -> None:
+        self.connection.execute("DELETE FROM map_symbols")
+        self.connection.executemany(
+            "INSERT INTO map_symbols VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    symbol.name,
+                    symbol.ram,
+                    symbol.rom,
+                    size,
+                    lmap.inputs[symbol.input_index].section,
+                    lmap.inputs[symbol.input_index].object_name,
+                )
+                for symbol, size in lmap.sized_symbols(section=None)
+            ),
+        )
+
+    def _index_object(self, o_file: Path) -> None:
+        o_file = o_file.resolve()
+        if not self._changed(o_file):
+            return
+        elf_file = elf.ElfFile.from_path(o_file)
+        table = elf_file.symbols
+        rows = []
+        for i in range(1, len(table)):
+            symbol = table[i]
+            if symbol.is_section:
+                continue
+            if symbol.shndx == elf.SHN_UNDEF:
+                section = "*UND*"
+            elif symbol.shndx < len(elf_file.sections):
+                section = elf_file.sections[symbol.shndx].name
+            else:
+                continue
+            rows.append(
+                (str(o_file), i, symbol.name, section, symbol.value, symbol.size)
+            )
+        self.connection.execute(
+            "DELETE FROM object_symbols WHERE object = ?", (str(o_file),)
+        )
+        self.connection.executemany(
+            "INSERT INTO object_symbols VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        self._mark(o_file)
+
+    def _index_headers(self) -> None:
+        seen = set()
+        for root in HEADER_ROOTS:
+            for path in sorted((self.sm64_source / root).rglob("*.h")):
+                header = str(path.relative_to(self.sm64_source))
+                seen.add(header)
+                if not self._changed(path):
+                    continue
+                self.connection.execute(
+                    "DELETE FROM header_names WHERE header = ?", (header,)
+                )
+                self.connection.executemany(
+                    "INSERT INTO header_names VALUES (?, ?, ?)",
+                    (
+                        (name, kind, header)
+                        for kind, names in header_index.scan_header(path).items()
+                        for name in set(names)
+                    ),
+                )
+                self._mark(path)
+
+        indexed = {
+            header
+            for (header,) in self.connection.execute(
+                "SELECT DISTINCT header FROM header_names"
+            )
+        }
+        for header in indexed - seen:
+            self.connection.execute(
+                "DELETE FROM header_names WHERE header = ?", (header,)
+            )
+            self.connection.execute(
+                "DELETE FROM sources WHERE path = ?",
+                (str(self.sm64_source / header),),
+            )
+
+    def symbol(self, name: str) -> Optional[SymbolRow]:
+        row = self.connection.execute(
+            "SELECT * FROM map_symbols WHERE name = ? LIMIT 1", (name,)
+        ).fetchone()
+        return None if row is None else SymbolRow(*row)
+
+    def symbols_in_range(
+        self, start: int, end: int, by: str = "ram"
+    ) -> List[SymbolRow]:
+        """Map symbols whose RAM (or ROM) address is in [start, end), in order."""
+        if by not in ("ram", "rom"):
+            raise Exception(f"can't look symbols up by {by}")
+        return [
+            SymbolRow(*row)
+            for row in self.connection.execute(
+                f"SELECT * FROM map_symbols WHERE {by} >= ? AND {by} < ? "
+                f"ORDER BY {by}",
+                (start, end),
+            )
+        ]
+
+    def symbols_in_object(self, object_name: str) -> List[SymbolRow]:
+        """Map symbols of one map input, e.g. build/eu/src/game/foo.o."""
+        return [
+            SymbolRow(*row)
+            for row in self.connection.execute(
+                "SELECT * FROM map_symbols WHERE object = ? ORDER BY ram",
+                (object_name,),
+            )
+        ]
+
+    def object_symbols(self, o_file: PathLike, section: str) -> List[str]:
+        """Names in an object's symtab defined in section (or "*UND*")."""
+        o_file = Path(o_file).resolve()
+        self._index_object(o_file)
+        self.connection.commit()
+        return [
+            name
+            for (name,) in self.connection.execute(
+                "SELECT name FROM object_symbols WHERE object = ? AND section = ? "
+                "ORDER BY position",
+                (str(o_file), section),
+            )
+        ]
+
+    def headers_declaring(self, name: str, kinds: Iterable[str]) -> List[str]:
+        """Headers declaring name, trying each kind in turn, in path order."""
+        for kind in kinds:
+            headers = [
+                header
+                for (header,) in self.connection.execute(
+                    "SELECT DISTINCT header FROM header_names "
+                    "WHERE name = ? AND kind = ? ORDER BY header",
+                    (name, kind),
+                )
+            ]
+            if headers:
+                return headers
+        return []
+
+
+@lru_cache(maxsize=None)
+def _open_db(sm64_source: str, version: str, pid: int) -> SymbolDatabase:
+    return SymbolDatabase.for_source(sm64_source, version)
+
+
+def open_db(sm64_source: str, version: str = "eu") -> SymbolDatabase:
+    """The database for sm64_source, opened once per process.
+
+    A forked worker gets its own connection; SQLite connections can't be
+    shared across fork().
+    """
+    return _open_db(sm64_source, version, os.getpid())
@@ -1,108 +1,254 @@
-#!/usr/bin/env python3
-import re
-from pathlib import Path
-
-
-def chunks(l, n):
-    for i in range(0, len(l), n):
-        yield l[i : i + n]
-
-
-def get_n_bytes(n, filename="./sm64_source/baserom.eu.z64", offset=0x002385DC):
-    return Path(filename).read_bytes()[
-        # 0x00237E30 : (0x00237E30 + n)  # file_select
-        # offset : (offset + n)
-        offset:
-    ]
-
-
-def parse(hexbytes):
-    return [phrase.replace(b"\x00", b"") for phrase in hexbytes.split(b"\xff")]
-
-
-def charmap(c):
-    int_val = int.from_bytes(c, "big")
-    current_winner = None
-
-    for map_line in Path("./sm64_source/charmap.txt").read_text().split("\n"):
-        if not map_line or map_line.startswith("#"):
-            continue
-        text, val = map_line.split(" = ")
-        if val == f"0x{int_val:0>2X}":
-            current_winner = text[1:-1]
-
-    return current_winner or "@"
-
-
-def translate(parsed):
-    return [
-        "".join(list(map(charmap, list(chunks(s, 1))))).replace("Õ", " ")
-        for s in parsed
-    ]
-
-
-def print_triplet(triplet):
-    en, fr, de = triplet
-    name = "".join(
-        list(filter(lambda c: c == "_" or c.isalnum(), en.replace(" ", "_")))
-    )
-    base = f"#define TEXT_{name}"
-    print(f'{base}_FR _("{fr}")')
-    print(f'{base}_DE _("{de}")')
-    print()
-
-
-def ezcopy(line):
-    print("#ifndef VERSION_EU")
-    print(line)
-    print("#else")
-    match = re.match(r"(.*\[\]) = \{ (.*) \};", line)
-    triple = (
-        "{ "
-        + match.group(2)
-        + " }, { "
-        + match.group(2)
-        + "_FR }, { "
-        + match.group(2)
-        + "_DE }"
-    )
-    print(match.group(1) + "[20] = {" + triple + "};")
-    print("#endif")
-    print()
-
-
-if __name__ == "__main__":
-    # texts = translate(parse(get_n_bytes(0x52F)))
-
-    # for triplet in chunks(texts[:12], 3):
-    #     print_triplet(triplet)
-
-    # for triplet in chunks(texts[16:-20], 3):
-    #     print_triplet(triplet)
-
-    # for triplet in chunks(texts[-19:-10], 3):
-    #     print_triplet(triplet)
-
-    # texts = translate(parse(get_n_bytes(0x50)))
-    # hexa = b'\x9E\x01\x9E\x0B\x18\x0B\x9F\x18\x16\x0B\x9E\x0B\x0A\x1D\x1D\x15\x0E\x0F\x12\x0E\x15\x0D\xFF\x00\x9E\x02\x9E\x20\x11\x18\x16\x19\x3E\x1C\x9E\x0F\x18\x1B\x1D\x1B\x0E\x1C\x1C\xFF\x9E\x03\x9E\x13\x18\x15\x15\x22\x9E\x1B\x18\x10\x0E\x1B\x9E\x0B\x0A\x22\xFF\x00\x9E\x04\x9E\x0C\x18\x18\x15\x6F\x9E\x0C\x18\x18\x15\x9E\x16\x18\x1E\x17\x1D\x0A\x12\x17\xFF\x00\x9E\x05\x9E\x0B\x12\x10\x9E\x0B\x18\x18\x3E\x1C\x9E\x11\x0A\x1E\x17\x1D\xFF\x00'
-    # print(translate(parse(hexa)))
-    # print(texts)
-    # print()
-
-    # print(
-    #     translate(
-    #         parse(get_n_bytes(0x400, "./sm64_source/mio0_menu_baserom.out", 0xFF50))
-    #     )
-    # )
-
-    hexa = get_n_bytes(0x400, "./sm64_source/mio0_menu_baserom.out", 0xFF50)
-    print("{\n")
-    for i, c in enumerate(chunks(hexa, 1)):
-        if i % 8 == 0:
-            print("\n    ", end="")
-        int_val = int.from_bytes(c, "big")
-        print(f"0x{int_val:0>2X}, ", end="")
-    print("\n}")
-
-    # ezcopy("static unsigned char textNew[] = { TEXT_NEW };")
-
+#!/usr/bin/env python3
+import argparse
+import re
+import sys
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+import c_array
+import linker_map
+import mio0
+from rom import Rom
+
+CHARMAP_PATH = "./sm64_source/charmap.txt"
+LANGUAGES = ("en", "fr", "de")
+
+
+def chunks(l, n):
+    for i in range(0, len(l), n):
+        yield l[i : i + n]
+
+
+def get_n_bytes(n, filename="./sm64_source/baserom.eu.z64", offset=0x002385DC):
+    return Rom.open(filename)[
+        # 0x00237E30 : (0x00237E30 + n)  # file_select
+        # offset : (offset + n)
+        offset:
+    ]
+
+
+def parse(hexbytes):
+    return [
+        phrase.replace(b"\x00", b"") for phrase in bytes(hexbytes).split(b"\xff")
+    ]
+
+
+@lru_cache(maxsize=None)
+def load_charmap(path=CHARMAP_PATH):
+    """Compile charmap.txt into a 256-entry table plus any multi-byte sequences.
+
+    Later lines override earlier ones, and unmapped bytes decode to "@".
+    """
+    table = ["@"] * 256
+    sequences = {}
+    for map_line in Path(path).read_text().split("\n"):
+        if not map_line or map_line.startswith("#"):
+            continue
+        text, val = map_line.rsplit(" = ", 1)
+        try:
+            values = bytes(int(v, 16) for v in re.split(r"[\s,]+", val.strip()))
+        except ValueError:
+            continue
+        if len(values) == 1:
+            table[values[0]] = text[1:-1] or "@"
+        else:
+            sequences[values.decode("latin-1")] = text[1:-1]
+
+    pattern = None
+    if sequences:
+        alternatives = sorted(sequences, key=len, reverse=True)
+        pattern = re.compile("(" + "|".join(map(re.escape, alternatives)) + ")")
+    return table, sequences, pattern
+
+
+def decode(data, path=CHARMAP_PATH):
+    table, sequences, pattern = load_charmap(path)
+    # latin-1 maps bytes 1:1 onto code points, so str.translate can index the
+    # table directly.
+    text = bytes(data).decode("latin-1")
+    if pattern is None:
+        return text.translate(table)
+    return "".join(
+        sequences[piece] if i % 2 else piece.translate(table)
+        for i, piece in enumerate(pattern.split(text))
+    )
+
+
+def charmap(c):
+    return decode(c)
+
+
+def translate(parsed):
+    return [decode(s).replace("Õ", " ") for s in parsed]
+
+
+class TextBank(NamedTuple):
+    filename: str
+    offset: int
+    length: int
+    # Linked object holding the MIO0 block that offset is relative to, if any.
+    mio0_object: Optional[str] = None
+    # Slices of the bank's strings that hold EN, FR, DE triplets; anything
+    # outside them is skipped. Stops may be negative, as in a slice.
+    triplet_ranges: Tuple[Tuple[int, Optional[int]], ...] = ((0, None),)
+
+
+# EN, FR and DE strings interleaved, 0xFF-terminated, padded with 0x00.
+TEXT_BANKS = {
+    "ingame": TextBank(
+        "baserom.eu.z64",
+        0x002385DC,
+        0x52F,
+        triplet_ranges=((0, 12), (16, -20), (-19, -10)),
+    ),
+    "menu": TextBank("baserom.eu.z64", 0xFF50, 0x400, "levels/menu/leveldata.mio0.o"),
+}
+
+
+def iter_strings(rom, start, end):
+    """Lazily yield the 0xFF-terminated strings in [start, end), minus padding."""
+    pos = start
+    while pos < end:
+        stop = rom.find(b"\xff", pos, end)
+        if stop == -1:
+            stop = end
+        yield bytes(rom[pos:stop]).replace(b"\x00", b"")
+        pos = stop + 1
+
+
+def iter_interleaved(strings, triplet_ranges=((0, None),)):
+    """Turn EN, FR, DE, EN, ... strings into (language, id, text) records.
+
+    Only the strings in triplet_ranges are used; ids keep counting across them.
+    """
+    strings = list(strings)
+    text_id = 0
+    for start, stop in triplet_ranges:
+        group = strings[start:stop]
+        for i, string in enumerate(group):
+            yield LANGUAGES[i % len(LANGUAGES)], text_id + i // len(LANGUAGES), string
+        text_id += -(-len(group) // len(LANGUAGES))
+
+
+def find_mio0_block(rom, object_name, sm64_source="./sm64_source"):
+    """rom's offset of the MIO0 block the build links from object_name.
+
+    The build's map only says where the block sits in the built ROM, which
+    needn't line up with rom. The offset is kept if rom has a block there of
+    the same decompressed size, and otherwise the one such block in rom is used.
+    """
+    block = linker_map.load_map(sm64_source).find_input(object_name)
+    if block is None or block.rom is None:
+        raise Exception(f"can't find {object_name} in the map file")
+    size = mio0.block_size(Rom.builtrom(sm64_source), block.rom)
+    candidates = [
+        offset
+        for offset in mio0.find_blocks(rom)
+        if mio0.block_size(rom, offset) == size
+    ]
+    if block.rom in candidates:
+        return block.rom
+    if len(candidates) == 1:
+        return candidates[0]
+    raise Exception(
+        f"{len(candidates)} MIO0 blocks in {rom.path} could be {object_name}: "
+        + ", ".join(hex(offset) for offset in candidates)
+    )
+
+
+def get_bank_data(bank, sm64_source="./sm64_source"):
+    """The ROM, or the decompressed MIO0 block, that a bank's offset points into."""
+    rom = Rom.open(Path(sm64_source) / bank.filename)
+    if bank.mio0_object is None:
+        return rom
+    return mio0.decompress_cached(
+        rom, find_mio0_block(rom, bank.mio0_object, sm64_source)
+    )
+
+
+def iter_text_bank(bank, sm64_source="./sm64_source"):
+    data = get_bank_data(bank, sm64_source)
+    strings = iter_strings(data, bank.offset, min(bank.offset + bank.length, len(data)))
+    for language, text_id, string in iter_interleaved(strings, bank.triplet_ranges):
+        yield language, text_id, decode(string).replace("Õ", " ")
+
+
+def iter_triplets(records):
+    """Group (language, id, text) records into (en, fr, de) triplets by id."""
+    current_id = None
+    texts = {}
+    for language, text_id, text in records:
+        if text_id != current_id and texts:
+            yield tuple(texts.get(language, "") for language in LANGUAGES)
+            texts = {}
+        current_id = text_id
+        texts[language] = text
+    if texts:
+        yield tuple(texts.get(language, "") for language in LANGUAGES)
+
+
+def print_triplet(triplet):
+    en, fr, de = triplet
+    name = "".join(
+        list(filter(lambda c: c == "_" or c.isalnum(), en.replace(" ", "_")))
+    )
+    base = f"#define TEXT_{name}"
+    print(f'{base}_FR _("{fr}")')
+    print(f'{base}_DE _("{de}")')
+    print()
+
+
+def ezcopy(line):
+    print("#ifndef VERSION_EU")
+    print(line)
+    print("#else")
+    match = re.match(r"(.*\[\]) = \{ (.*) \};", line)
+    triple = (
+        "{ "
+        + match.group(2)
+        + " }, { "
+        + match.group(2)
+        + "_FR }, { "
+        + match.group(2)
+        + "_DE }"
+    )
+    print(match.group(1) + "[20] = {" + triple + "};")
+    print("#endif")
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sm64-source", default="./sm64_source")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    text_parser = subparsers.add_parser("text", help="Decode EN/FR/DE text banks")
+    text_parser.add_argument(
+        "--bank",
+        action="append",
+        choices=list(TEXT_BANKS),
+        help="Bank to decode (default: all)",
+    )
+    text_parser.add_argument(
+        "--defines", action="store_true", help="Print TEXT_ defines via print_triplet"
+    )
+    subparsers.add_parser("bytes", help="Dump the menu bytes as a C array")
+    args = parser.parse_args()
+
+    if args.command == "text":
+        for bank_name in args.bank or TEXT_BANKS:
+            records = iter_text_bank(TEXT_BANKS[bank_name], args.sm64_source)
+            if args.defines:
+                for triplet in iter_triplets(records):
+                    print_triplet(triplet)
+            else:
+                for language, text_id, text in records:
+                    print(f"{bank_name}\t{language}\t{text_id}\t{text}")
+    else:
+        menu = TEXT_BANKS["menu"]
+        hexa = get_bank_data(menu, args.sm64_source)[
+            menu.offset : menu.offset + menu.length
+        ]
+        c_array.write_array(sys.stdout, hexa)
+
+    # ezcopy("static unsigned char textNew[] = { TEXT_NEW };")
@@ -1,37 +1,91 @@
-# run this from inside sm64_source
-from pathlib import Path
-import subprocess
-
-
-def delete_if_unused(nonmatching: str):
-    ret = subprocess.run(
-        ["grep", "-r", nonmatching, "./src", "./lib"], stdout=subprocess.DEVNULL
-    ).returncode
-    if ret != 0:
-        print(f"deleting {nonmatching}")
-        Path(nonmatching).unlink()
-
-
-files = Path("./asm/non_matchings").glob("*.s")
-for nonmatching in [str(filename) for filename in files]:
-    # delete_if_unused(nonmatching)
-    if not (nonmatching.endswith("eu.s") or nonmatching.endswith("eu.inc.s")):
-        continue
-
-    dest = (
-        Path(nonmatching).parent
-        / "eu"
-        / (Path(nonmatching).name.replace("_eu.s", ".s").replace("_eu.inc.s", ".inc.s"))
-    )
-    
-    Path(nonmatching).replace(dest)
-    found = False
-    for src_file in Path("./src").rglob("*.c"):
-        fulltext = src_file.read_text()
-        if nonmatching in fulltext:
-            print(f"replacing in {str(src_file)}")
-            replacedtext = fulltext.replace(nonmatching, str(dest))
-            src_file.write_text(replacedtext)
-            break
-    print(f"done with {str(dest)}")
-
+# run this from inside sm64_source
+import argparse
+import re
+from pathlib import Path
+from typing import Dict, List, Set
+
+from edit_plan import EditPlan
+
+ASM_REF_RE = re.compile(rb"asm/non_matchings/[\w/.-]+")
+
+
+def eu_destination(nonmatching: str) -> str:
+    return str(
+        Path(nonmatching).parent
+        / "eu"
+        / (Path(nonmatching).name.replace("_eu.s", ".s").replace("_eu.inc.s", ".inc.s"))
+    )
+
+
+def index_asm_references(roots: List[str]) -> Dict[str, Set[Path]]:
+    """Read every file under roots once; asm path -> files that mention it."""
+    inverted: Dict[str, Set[Path]] = {}
+    for root in roots:
+        for path in Path(root).rglob("*"):
+            if not path.is_file():
+                continue
+            for match in set(ASM_REF_RE.findall(path.read_bytes())):
+                inverted.setdefault(match.decode("utf-8"), set()).add(path)
+    return inverted
+
+
+def rewrite_references(plan: EditPlan, path: Path, moves: Dict[str, str]):
+    """Point every moved asm path in path at its destination."""
+    data = plan.read_bytes(path)
+    replaced = ASM_REF_RE.sub(
+        lambda match: moves.get(
+            match.group().decode("utf-8"), match.group().decode("utf-8")
+        ).encode("utf-8"),
+        data,
+    )
+    if replaced != data:
+        print(f"replacing in {str(path)}")
+        plan.write_bytes(path, replaced)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Move *_eu.s non-matchings into asm/non_matchings/eu."
+    )
+    parser.add_argument(
+        "--delete-unused",
+        action="store_true",
+        help="delete non-matching asm that nothing in src or lib refers to",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the plan without applying it"
+    )
+    args = parser.parse_args()
+
+    nonmatchings = sorted(
+        str(filename) for filename in Path("./asm/non_matchings").glob("*.s")
+    )
+    inverted = index_asm_references(["./src", "./lib"])
+
+    plan = EditPlan()
+    moves: Dict[str, str] = {}
+    for nonmatching in nonmatchings:
+        dest = eu_destination(nonmatching)
+        # A run interrupted after rewriting references leaves them at dest.
+        if nonmatching not in inverted and dest not in inverted:
+            print(f"{nonmatching} is unused")
+            if args.delete_unused:
+                print(f"deleting {nonmatching}")
+                plan.delete(nonmatching)
+                continue
+        if nonmatching.endswith("eu.s") or nonmatching.endswith("eu.inc.s"):
+            moves[nonmatching] = dest
+
+    to_rewrite: Set[Path] = set()
+    for nonmatching, dest in moves.items():
+        plan.move(nonmatching, dest)
+        to_rewrite |= {
+            path
+            for path in inverted.get(nonmatching, set())
+            if path.parts[0] == "src" and path.suffix == ".c"
+        }
+        print(f"done with {dest}")
+
+    for path in sorted(to_rewrite):
+        rewrite_references(plan, path, moves)
+    plan.apply(args.dry_run)